@@ -0,0 +1,190 @@
+# admission.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# Default cap for channels without their own (see channel_limits)
+MAX_PENDING_REQUESTS = int(os.getenv("API_MAX_PENDING_REQUESTS", "8"))
+MAX_TRACKED_CALLERS = int(os.getenv("RATE_LIMIT_MAX_TRACKED_CALLERS", "10000"))
+
+
+# ============================================================
+# ERRORS
+# ============================================================
+
+class RateLimited(Exception):
+    """
+    Caller exceeded its token bucket (maps to HTTP 429).
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """
+    Request queue is full (maps to HTTP 503).
+    """
+
+
+# ============================================================
+# TOKEN BUCKET
+# ============================================================
+
+class TokenBucket:
+
+    def __init__(self, rate_per_second: float, burst: int):
+
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def try_acquire(self):
+        """
+        Take one token. Returns 0 on success, else seconds until one
+        is available. Caller holds the limiter lock.
+        """
+
+        now = time.monotonic()
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+
+        return (1 - self.tokens) / self.rate if self.rate else float("inf")
+
+
+# ============================================================
+# ADMISSION CONTROLLER
+# ============================================================
+
+class AdmissionController:
+    """
+    Front door for agent work:
+    - per (channel, user_id) token bucket → RateLimited
+    - bounded number of pending (queued + running) requests per channel
+      → Overloaded, so a burst on one channel can't shed another's
+    admit() returns a release callable that must run when the work ends.
+    channel_limits: {channel: max pending}; others use max_pending.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        max_pending: int = MAX_PENDING_REQUESTS,
+        max_tracked: int = MAX_TRACKED_CALLERS,
+        channel_limits: dict = None
+    ):
+
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_pending = max_pending
+        self.max_tracked = max_tracked
+        self.channel_limits = dict(channel_limits or {})
+
+        self._buckets = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "admitted": 0,
+            "rate_limited": 0,
+            "overloaded": 0,
+        }
+
+    def _bucket(self, channel: str, user_id: str) -> TokenBucket:
+        """
+        Caller holds the lock.
+        """
+
+        key = (channel, user_id)
+
+        bucket = self._buckets.get(key)
+
+        if bucket is None:
+
+            bucket = TokenBucket(self.rate_per_second, self.burst)
+            self._buckets[key] = bucket
+
+            # Forget the least recently seen callers
+            while len(self._buckets) > self.max_tracked:
+                self._buckets.popitem(last=False)
+
+        self._buckets.move_to_end(key)
+
+        return bucket
+
+    def charge(self, channel: str = "unknown", user_id: str = "anonymous"):
+        """
+        Rate limit only: take one token without a pending slot (e.g. a
+        request that joins work already running). Raises RateLimited.
+        """
+
+        with self._lock:
+
+            wait = self._bucket(channel, user_id).try_acquire()
+
+            if wait:
+                self._stats["rate_limited"] += 1
+                raise RateLimited(wait)
+
+    def admit(self, channel: str = "unknown", user_id: str = "anonymous"):
+
+        with self._lock:
+
+            bucket = self._bucket(channel, user_id)
+
+            pending = self._pending.get(channel, 0)
+            limit = self.channel_limits.get(channel, self.max_pending)
+
+            if pending >= limit:
+                self._stats["overloaded"] += 1
+                raise Overloaded(f"Server busy ({pending} {channel} requests pending)")
+
+            wait = bucket.try_acquire()
+
+            if wait:
+                self._stats["rate_limited"] += 1
+                raise RateLimited(wait)
+
+            self._pending[channel] = pending + 1
+            self._stats["admitted"] += 1
+
+        released = threading.Event()
+
+        def release():
+            if released.is_set():
+                return
+            released.set()
+            with self._lock:
+                self._pending[channel] -= 1
+
+        return release
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            return {
+                **self._stats,
+                "pending": dict(self._pending),
+                "max_pending": {
+                    **{c: self.max_pending for c in self._pending},
+                    **self.channel_limits,
+                },
+                "tracked_callers": len(self._buckets),
+            }
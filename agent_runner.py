@@ -1,34 +1,28 @@
 # agent_runner.py
 
 import os
-import json
-import boto3
 import uuid
 import time
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator
+
+from config import get_secret
 
 # ============================================================
 # LangSmith Secrets + Env Bootstrap
 # ============================================================
 
 def _load_langsmith_key_from_secrets():
-    secret_name = "dev/python/api"
-    region_name = "eu-west-1"
-
-    client = boto3.client("secretsmanager", region_name=region_name)
-    response = client.get_secret_value(SecretId=secret_name)
-
-    secret_string = response.get("SecretString")
-    secret_json = json.loads(secret_string)
-
-    return secret_json["LANGCHAIN_API_KEY"]
+    # Shared, memoized fetch: the same secret also serves Redis/LangCache
+    return get_secret()["LANGCHAIN_API_KEY"]
 
 
 def _init_langsmith_env():
     os.environ["LANGCHAIN_TRACING_V2"] = "true"
     os.environ["LANGCHAIN_PROJECT"] = "ai-document-agent-dev"
     os.environ["LANGCHAIN_ENDPOINT"] = "https://eu.api.smith.langchain.com"
-    os.environ["LANGCHAIN_API_KEY"] = _load_langsmith_key_from_secrets()
+    if not os.getenv("LANGCHAIN_API_KEY"):
+        os.environ["LANGCHAIN_API_KEY"] = _load_langsmith_key_from_secrets()
 
 
 _init_langsmith_env()
@@ -45,7 +39,12 @@ from plan_generator import generate_plan
 # Tools
 # ============================================================
 
-from tools.search_documents import search_documents_tool
+from tools.search_documents import (
+    search_documents_tool,
+    stream_search_answer,
+    answer_search,
+    retrieve_documents,
+)
 from tools.download_document import download_document_tool
 from tools.get_all_document_metadata import get_all_document_metadata_tool
 
@@ -59,6 +58,181 @@ TOOL_REGISTRY = {
     "list_documents": get_all_document_metadata_tool,
 }
 
+# ============================================================
+# SPECULATIVE RETRIEVAL
+# ============================================================
+# Most plans start with search_documents, so retrieval (embedding +
+# KNN + grouping) runs while the planner is still deciding. The result
+# is handed to the search step, or dropped if the plan has no search.
+
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+
+_speculation_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATIVE_WORKERS", "4")),
+    thread_name_prefix="speculative-retrieval"
+)
+
+
+def _start_speculative_retrieval(user_input: str):
+
+    query = user_input.strip()
+
+    if not SPECULATIVE_RETRIEVAL or not query:
+        return None
+
+    # Set by the worker: queue time and never-started runs aren't retrieval time
+    speculation = {"start": None, "end": None}
+
+    def run():
+        speculation["start"] = time.perf_counter()
+        try:
+            return retrieve_documents(query)
+        finally:
+            speculation["end"] = time.perf_counter()
+
+    speculation["future"] = _speculation_executor.submit(run)
+
+    return speculation
+
+
+def _report_speculation(speculation, plan, plan_start: float, plan_end: float, trace_id: str):
+
+    if speculation is None:
+        return
+
+    used = "search_documents" in (plan or [])
+
+    if not used:
+        speculation["future"].cancel()
+
+    start, end = speculation["start"], speculation["end"]
+
+    # None when the retrieval never ran (cancelled / still queued) or,
+    # for retrieval_ms, hasn't finished yet
+    retrieval_ms = round((end - start) * 1000, 2) if start and end else None
+
+    overlap_ms = None
+
+    if start:
+        overlap_ms = round(max(0.0, min(plan_end, end or plan_end) - max(plan_start, start)) * 1000, 2)
+
+    print(
+        f"🔀 SPECULATIVE RETRIEVAL trace={trace_id} used={used} "
+        f"cancelled={speculation['future'].cancelled()} "
+        f"plan_ms={round((plan_end - plan_start) * 1000, 2)} "
+        f"retrieval_ms={retrieval_ms} "
+        f"overlap_ms={overlap_ms}"
+    )
+
+
+# ============================================================
+# STEP EXECUTION
+# ============================================================
+
+SEPARATOR = "\n\n━━━━━━━━━━━━━━━━━━━━━━\n\n"
+
+
+def _run_step(
+    step: str,
+    user_input: str,
+    context: Dict[str, Any],
+    speculation=None
+) -> List[str]:
+    """
+    Run one non-streaming plan step; returns the outputs it produced.
+    """
+
+    outputs: List[str] = []
+
+    tool = TOOL_REGISTRY.get(step)
+
+    if not tool:
+        outputs.append(f"⚠️ Unknown step ignored: {step}")
+        return outputs
+
+    print(f"\n🟢 EXECUTING STEP → {step}")
+    step_start = time.perf_counter()
+
+    try:
+
+        if step == "download_document":
+
+            resolved = context.get("resolved_filenames", [])
+
+            if not resolved:
+                outputs.append("❌ No authoritative document available for download.")
+                return outputs
+
+            filename = resolved[0]
+
+            assert filename in resolved, "FATAL: download document mismatch"
+
+            result = tool.run(f'filename="{filename}"')
+
+            if isinstance(result, dict):
+
+                context.update(result)
+
+                download_url = result.get("download_url")
+
+                if download_url:
+                    outputs.append("📥 Download Link:")
+                    outputs.append(download_url)
+
+            else:
+                outputs.append(str(result))
+
+        else:
+
+            # Rule: full user question passed unchanged
+            if step == "search_documents" and speculation is not None:
+                result = answer_search(user_input.strip(), retrieval=speculation["future"])
+            else:
+                result = tool.run(user_input)
+
+            if isinstance(result, dict):
+
+                context.update(result)
+
+                if "answer" in result:
+                    outputs.append(result["answer"])
+
+            else:
+                outputs.append(str(result))
+
+    except Exception as e:
+
+        outputs.append(f"❌ Error executing {step}: {str(e)}")
+
+    step_end = time.perf_counter()
+
+    print(
+        f"⏱️ STEP {step} completed in "
+        f"{round((step_end - step_start) * 1000, 2)} ms"
+    )
+
+    return outputs
+
+
+def _response_footer(context: Dict[str, Any], start_ts: float, trace_id: str) -> str:
+
+    total_ms = round((time.perf_counter() - start_ts) * 1000, 2)
+
+    footer = ""
+
+    followups = context.get("followup_questions", [])
+
+    if followups:
+        footer += "\n\n💡 You can also ask:\n"
+        for q in followups:
+            footer += f"- {q}\n"
+
+    footer += f"\n⏱️ Response Time: {total_ms} ms"
+    footer += f"\n🧵 Trace ID: {trace_id}"
+
+    return footer
+
+
 # ============================================================
 # MAIN AGENT ENTRY
 # ============================================================
@@ -82,12 +256,19 @@ def run_agent(
     print("GENERATING PLAN")
 
     # --------------------------------------------------------
-    # STEP 1: PLAN
+    # STEP 1: PLAN (RETRIEVAL STARTS SPECULATIVELY IN PARALLEL)
     # --------------------------------------------------------
 
+    speculation = _start_speculative_retrieval(user_input)
+
+    plan_start = time.perf_counter()
+
     plan = generate_plan(user_input)
 
+    plan_end = time.perf_counter()
+
     if not plan:
+        _report_speculation(speculation, plan, plan_start, plan_end, trace_id)
         return "❌ Unable to determine how to answer your question."
 
     print(f"🧠 EXECUTION PLAN → {plan}")
@@ -100,89 +281,121 @@ def run_agent(
     # --------------------------------------------------------
 
     for step in plan:
+        outputs.extend(_run_step(step, user_input, context, speculation))
 
-        tool = TOOL_REGISTRY.get(step)
+    _report_speculation(speculation, plan, plan_start, plan_end, trace_id)
 
-        if not tool:
-            outputs.append(f"⚠️ Unknown step ignored: {step}")
-            continue
+    # --------------------------------------------------------
+    # STEP 3: FINAL RESPONSE
+    # --------------------------------------------------------
 
-        print(f"\n🟢 EXECUTING STEP → {step}")
-        step_start = time.perf_counter()
+    final_answer = SEPARATOR.join(outputs)
 
-        try:
+    final_answer += _response_footer(context, start_ts, trace_id)
 
-            if step == "download_document":
+    return final_answer
 
-                resolved = context.get("resolved_filenames", [])
 
-                if not resolved:
-                    outputs.append("❌ No authoritative document available for download.")
-                    continue
+# ============================================================
+# STREAMING AGENT ENTRY
+# ============================================================
 
-                filename = resolved[0]
+@traceable(
+    name="run_agent_stream",
+    run_type="chain",
+    tags=["production", "planner-executor", "streaming"]
+)
+def run_agent_stream(
+    user_input: str,
+    *,
+    channel: str = "unknown",
+    user_id: str = "anonymous"
+) -> Iterator[str]:
+    """
+    Same plan/execute flow as run_agent, but yields the response text
+    as it is produced: search answers token by token, other steps
+    whole. Joining everything yielded gives run_agent's output.
+    """
 
-                assert filename in resolved, "FATAL: download document mismatch"
+    trace_id = str(uuid.uuid4())
+    start_ts = time.perf_counter()
+    first_token_ms = None
 
-                result = tool.run(f'filename="{filename}"')
+    print(f"\nTRACE_ID = {trace_id} (streaming)")
 
-                if isinstance(result, dict):
+    speculation = _start_speculative_retrieval(user_input)
 
-                    context.update(result)
+    plan_start = time.perf_counter()
 
-                    download_url = result.get("download_url")
+    plan = generate_plan(user_input)
 
-                    if download_url:
-                        outputs.append("📥 Download Link:")
-                        outputs.append(download_url)
+    plan_end = time.perf_counter()
 
-                else:
-                    outputs.append(str(result))
+    if not plan:
+        _report_speculation(speculation, plan, plan_start, plan_end, trace_id)
+        yield "❌ Unable to determine how to answer your question."
+        return
 
-            else:
+    print(f"🧠 EXECUTION PLAN → {plan}")
 
-                # Rule: full user question passed unchanged
-                result = tool.run(user_input)
+    context: Dict[str, Any] = {}
+    emitted_any = False
 
-                if isinstance(result, dict):
+    for step in plan:
 
-                    context.update(result)
+        if step == "search_documents":
 
-                    if "answer" in result:
-                        outputs.append(result["answer"])
+            print(f"\n🟢 STREAMING STEP → {step}")
+            step_start = time.perf_counter()
+            started_output = False
 
-                else:
-                    outputs.append(str(result))
+            try:
 
-        except Exception as e:
+                retrieval = speculation["future"] if speculation else None
 
-            outputs.append(f"❌ Error executing {step}: {str(e)}")
+                for kind, value in stream_search_answer(user_input, retrieval=retrieval):
 
-        step_end = time.perf_counter()
+                    if kind == "result":
+                        context.update(value)
+                        continue
 
-        print(
-            f"⏱️ STEP {step} completed in "
-            f"{round((step_end - step_start) * 1000, 2)} ms"
-        )
+                    if not started_output:
+                        if emitted_any:
+                            yield SEPARATOR
+                        started_output = True
+                        emitted_any = True
 
-    # --------------------------------------------------------
-    # STEP 3: FINAL RESPONSE
-    # --------------------------------------------------------
+                    if first_token_ms is None:
+                        first_token_ms = round((time.perf_counter() - start_ts) * 1000, 2)
+                        print(f"⚡ TIME TO FIRST TOKEN: {first_token_ms} ms")
 
-    total_ms = round((time.perf_counter() - start_ts) * 1000, 2)
+                    yield value
 
-    final_answer = "\n\n━━━━━━━━━━━━━━━━━━━━━━\n\n".join(outputs)
+            except Exception as e:
 
-    followups = context.get("followup_questions", [])
+                if emitted_any:
+                    yield SEPARATOR
+                emitted_any = True
+                yield f"❌ Error executing {step}: {str(e)}"
 
-    if followups:
-        final_answer += "\n\n💡 You can also ask:\n"
-        for q in followups:
-            final_answer += f"- {q}\n"
+            print(
+                f"⏱️ STEP {step} completed in "
+                f"{round((time.perf_counter() - step_start) * 1000, 2)} ms"
+            )
+            continue
+
+        for output in _run_step(step, user_input, context, speculation):
+
+            if emitted_any:
+                yield SEPARATOR
+            emitted_any = True
+
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start_ts) * 1000, 2)
+                print(f"⚡ TIME TO FIRST TOKEN: {first_token_ms} ms")
 
-    final_answer += f"\n⏱️ Response Time: {total_ms} ms"
-    final_answer += f"\n🧵 Trace ID: {trace_id}"
+            yield output
 
-    time.sleep(1.5)
+    _report_speculation(speculation, plan, plan_start, plan_end, trace_id)
 
-    return final_answer
\ No newline at end of file
+    yield _response_footer(context, start_ts, trace_id)
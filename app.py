@@ -1,16 +1,38 @@
 import os
+import json
+import asyncio
 import random
 import logging
-from typing import Optional
+import threading
+from collections import deque
+from typing import List, Optional
 from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 from twilio.rest import Client
 
-from agent_runner import run_agent
-from tools.search_documents import search_documents_tool
+from agent_runner import run_agent, run_agent_stream
+from llm import aclose_bedrock
+from admission import AdmissionController, RateLimited, Overloaded
+from bedrock_invoke import get_bedrock_stats
+from channel_pool import ChannelPool
+from cache_utils import TTLLRUCache, normalize_text
+from single_flight import SingleFlight
+from config import startup_report
+from metrics import render_metrics
+from utils import get_embedding_cache_stats
+from lang_cache_utils import get_answer_cache_stats
+from plan_generator import get_planner_stats
+from tools.search_documents import (
+    aanswer_search,
+    retrieve_documents_batch,
+    answer_search,
+    NO_MATCHES,
+    TWO_PHASE_KNN,
+)
 from tools.download_document import download_document_tool
 
 import time
@@ -31,11 +53,114 @@ logger = logging.getLogger("family-docs-agent-api")
 # ============================================================
 app = FastAPI(title="Family Docs Agent API")
 
-executor = ThreadPoolExecutor(
-    max_workers=int(os.getenv("API_MAX_WORKERS", "2"))
+# Separate, separately sized pools per channel: a WhatsApp burst can't
+# starve REST callers (and vice versa). Agent runs are awaited, so the
+# event loop keeps serving /health and other cheap endpoints meanwhile.
+channel_pools = {
+    "rest": ChannelPool("rest", int(os.getenv("API_REST_WORKERS", os.getenv("API_MAX_WORKERS", "2")))),
+    "whatsapp": ChannelPool("whatsapp", int(os.getenv("API_WHATSAPP_WORKERS", "2"))),
+}
+
+
+# Rate limits per (channel, user_id) and a cap on queued + running agent
+# requests per channel (sized from its pool); excess load is rejected
+# fast instead of piling up
+API_MAX_PENDING_PER_WORKER = int(os.getenv("API_MAX_PENDING_PER_WORKER", "4"))
+
+admission = AdmissionController(
+    channel_limits={
+        name: pool.max_workers * API_MAX_PENDING_PER_WORKER
+        for name, pool in channel_pools.items()
+    }
 )
 
 
+def submit_admitted(channel: str, user_id: str, fn, /, *args, **kwargs):
+    """
+    Admit, then submit fn to the channel's pool. Raises RateLimited/Overloaded.
+    Positional-only, so fn's own channel=/user_id= kwargs pass through.
+    """
+    release = admission.admit(channel, user_id)
+    try:
+        future = channel_pools[channel].submit(fn, *args, **kwargs)
+    except Exception:
+        release()
+        raise
+    # Released when the work ends, even if the awaiting request is cancelled
+    future.add_done_callback(lambda _: release())
+    return future
+
+
+# Identical questions arriving while one is already running wait on that
+# run instead of starting their own (planner, embedding, KNN, Claude).
+# Keyed per channel + user by default; SINGLE_FLIGHT_SCOPE=global is an
+# explicit opt-in to share runs across users.
+SINGLE_FLIGHT_SCOPE = os.getenv("SINGLE_FLIGHT_SCOPE", "user").lower()
+
+agent_flights = SingleFlight()
+
+
+def single_flight_key(question: str, channel: str, user_id: str) -> str:
+    scope = "*" if SINGLE_FLIGHT_SCOPE == "global" else f"{channel}:{user_id}"
+    return f"{scope}|{normalize_text(question)}"
+
+
+async def run_agent_single_flight(channel: str, user_id: str, question: str):
+    """
+    Await run_agent, joining an identical in-flight run if there is one.
+    The leader takes a full admission slot; followers are still charged
+    against their rate limit. Raises RateLimited/Overloaded.
+    """
+    future, leader = agent_flights.join_or_start(
+        single_flight_key(question, channel, user_id),
+        lambda: submit_admitted(
+            channel, user_id, run_agent, question, channel=channel, user_id=user_id
+        ),
+        join=lambda: admission.charge(channel, user_id),
+    )
+
+    if not leader:
+        logger.info(f"Joined in-flight run | channel={channel} question='{question}'")
+
+    # Shielded: one caller disconnecting must not cancel the shared run
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+def admission_http_error(e: Exception) -> HTTPException:
+    if isinstance(e, RateLimited):
+        return HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, please retry shortly",
+        headers={"Retry-After": "2"},
+    )
+
+
+def rest_user_id(req, request: Request) -> str:
+    options = req.options or {}
+    if options.get("user_id"):
+        return str(options["user_id"])
+    return request.client.host if request.client else "anonymous"
+
+
+@app.on_event("startup")
+async def log_startup_report():
+    # Secrets fetches (and their source) and client builds done so far
+    logger.info(f"Startup report: {json.dumps(startup_report())}")
+
+
+@app.on_event("shutdown")
+async def close_executors():
+    for pool in channel_pools.values():
+        pool.shutdown()
+    canned_reply_executor.shutdown(wait=False, cancel_futures=True)
+    await aclose_bedrock()
+
+
 # ============================================================
 # Twilio Configuration
 # ============================================================
@@ -96,28 +221,64 @@ class SearchRequest(BaseModel):
     top_k: Optional[int] = 5
 
 
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = 5
+    retrieval_only: Optional[bool] = False
+
+
 # ============================================================
 # Health Check
 # ============================================================
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok", "service": "family-docs-agent"}
 
 
 # ============================================================
-# Main Agent API (UNCHANGED)
+# Runtime Stats
+# ============================================================
+@app.get("/api/v1/stats")
+async def api_stats():
+    return {
+        "admission": admission.stats(),
+        "channels": {name: pool.stats() for name, pool in channel_pools.items()},
+        "whatsapp": whatsapp_stats(),
+        "single_flight": agent_flights.stats(),
+        "startup": startup_report(),
+        "embedding_cache": get_embedding_cache_stats(),
+        "answer_cache": get_answer_cache_stats(),
+        "planner": get_planner_stats(),
+        "bedrock": get_bedrock_stats(),
+    }
+
+
+# ============================================================
+# Prometheus Metrics
+# ============================================================
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+# ============================================================
+# Main Agent API
 # ============================================================
 @app.post("/api/v1/query")
-def api_query(req: QueryRequest):
+async def api_query(req: QueryRequest, request: Request):
     if not req.question:
         raise HTTPException(status_code=400, detail="question is required")
 
     start_time = time.perf_counter()
     logger.info(f"REST query received: {req.question}")
 
+    user_id = rest_user_id(req, request)
+
     try:
-        future = executor.submit(run_agent, req.question)
-        result = future.result()
+        result = await run_agent_single_flight("rest", user_id, req.question)
 
         end_time = time.perf_counter()
         elapsed_ms = round((end_time - start_time) * 1000, 2)
@@ -134,6 +295,10 @@ def api_query(req: QueryRequest):
         answer_text = f"{result}\n\n-TS:{elapsed_ms} ms"
         return {"answer": answer_text}
 
+    except (RateLimited, Overloaded) as e:
+        logger.warning(f"REST query rejected ({type(e).__name__}) | user={user_id}")
+        raise admission_http_error(e)
+
     except Exception:
         logger.exception("Agent execution failed")
         raise HTTPException(
@@ -143,17 +308,219 @@ def api_query(req: QueryRequest):
 
 
 # ============================================================
-# Search API (UNCHANGED)
+# Streaming Agent API (Server-Sent Events)
+# ============================================================
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    Runs on_close() once the response is over, however it ends: also when
+    the client disconnects before the body generator ever starts (its own
+    finally would never run then).
+    """
+
+    def __init__(self, *args, on_close, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+@app.post("/api/v1/query/stream")
+async def api_query_stream(req: QueryRequest, request: Request):
+    if not req.question:
+        raise HTTPException(status_code=400, detail="question is required")
+
+    logger.info(f"REST stream query received: {req.question}")
+
+    user_id = rest_user_id(req, request)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    stop = threading.Event()
+
+    def event_stream():
+        start_time = time.perf_counter()
+        first_token_ms = None
+
+        try:
+            for text in run_agent_stream(req.question, channel="rest", user_id=user_id):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - start_time) * 1000, 2)
+                yield sse_event("token", {"text": text})
+
+            elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+            logger.info(
+                f"REST stream completed in {elapsed_ms} ms "
+                f"(first token {first_token_ms} ms) | question='{req.question}'"
+            )
+            yield sse_event("done", {"elapsed_ms": elapsed_ms, "first_token_ms": first_token_ms})
+
+        except Exception:
+            logger.exception("Agent streaming failed")
+            yield sse_event("error", {"detail": "Agent failed while processing the request"})
+
+    def pump():
+        # Runs on the rest pool; hands events to the response via the loop
+        stream = event_stream()
+        try:
+            for event in stream:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            # Event loop closed underneath us (shutdown)
+            pass
+        finally:
+            stream.close()
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+            except RuntimeError:
+                pass
+
+    # The admission slot is held until the worker finishes (released on
+    # the future); a client disconnect only tells the worker to stop early
+    try:
+        submit_admitted("rest", user_id, pump)
+    except (RateLimited, Overloaded) as e:
+        logger.warning(f"REST stream rejected ({type(e).__name__}) | user={user_id}")
+        raise admission_http_error(e)
+
+    async def body():
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            yield event
+
+    return ClosingStreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        on_close=stop.set,
+    )
+
+
+# ============================================================
+# Search API
 # ============================================================
 @app.post("/api/v1/search")
-def api_search(req: SearchRequest):
+async def api_search(req: SearchRequest):
     input_str = f'query="{req.query}", top_k={req.top_k}'
-    result = search_documents_tool(input_str)
+    result = await aanswer_search(input_str)
     return {"results": result}
 
 
 # ============================================================
-# Download API (UNCHANGED)
+# Batch Search API
+# ============================================================
+# Back-office jobs send many queries at once: embeddings run
+# concurrently, all KNN queries share one Redis pipeline, and answers
+# (unless retrieval_only) are generated in parallel.
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "50"))
+
+batch_answer_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SEARCH_BATCH_ANSWER_WORKERS", "4")),
+    thread_name_prefix="batch-answer"
+)
+
+
+def retrieval_summary(retrieval) -> list:
+    if not retrieval or isinstance(retrieval, Exception):
+        return []
+    return [
+        {
+            "filename": fname,
+            "document_id": data["hits"][0].get("document_id"),
+            "score": round(data["score"], 4),
+            "chunks": len(data["hits"]),
+        }
+        for fname, data in retrieval["top_docs"]
+    ]
+
+
+def timed_answer(query: str, top_k: int, retrieval):
+    start = time.perf_counter()
+    # This query's search failed; the error is reported on its entry
+    if isinstance(retrieval, Exception):
+        return None, 0.0
+    # None = batch search ran and found nothing; don't search again
+    if retrieval is None:
+        retrieval = NO_MATCHES
+    answer = answer_search(query, top_k, TWO_PHASE_KNN, retrieval=retrieval)
+    return answer, round((time.perf_counter() - start) * 1000, 2)
+
+
+@app.post("/api/v1/search/batch")
+def api_search_batch(req: BatchSearchRequest):
+    queries = [q.strip() for q in req.queries]
+
+    if not queries or not all(queries):
+        raise HTTPException(status_code=400, detail="queries must be non-empty strings")
+
+    if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch",
+        )
+
+    start_time = time.perf_counter()
+
+    retrieval_stats = []
+    retrievals = retrieve_documents_batch(
+        queries, req.top_k, two_phase=TWO_PHASE_KNN, stats=retrieval_stats
+    )
+
+    retrieval_ms = round((time.perf_counter() - start_time) * 1000, 2)
+
+    answers = None
+    if not req.retrieval_only:
+        answers = list(batch_answer_executor.map(
+            timed_answer, queries, [req.top_k] * len(queries), retrievals
+        ))
+
+    results = []
+
+    for idx, (query, retrieval, stats) in enumerate(zip(queries, retrievals, retrieval_stats)):
+        item = {
+            "query": query,
+            "documents": retrieval_summary(retrieval),
+            "timing": {
+                "embed_ms": stats.get("embed_ms"),
+                "search_ms": stats.get("search_ms"),
+            },
+        }
+
+        if isinstance(retrieval, Exception):
+            item["error"] = str(retrieval)
+
+        if answers is not None:
+            item["answer"], item["timing"]["answer_ms"] = answers[idx]
+
+        results.append(item)
+
+    elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+
+    logger.info(
+        f"Batch search: {len(queries)} queries in {elapsed_ms} ms "
+        f"(retrieval {retrieval_ms} ms, retrieval_only={req.retrieval_only})"
+    )
+
+    return {
+        "results": results,
+        "retrieval_ms": retrieval_ms,
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+# ============================================================
+# Download API
 # ============================================================
 @app.get("/api/v1/download")
 def api_download(filename: Optional[str] = None, document_id: Optional[str] = None):
@@ -177,60 +544,216 @@ def api_download(filename: Optional[str] = None, document_id: Optional[str] = No
 
 
 # ============================================================
-# Random API (UNCHANGED)
+# Random API
 # ============================================================
 @app.post("/api/v1/random")
-def api_random():
+async def api_random():
     return {"random_number": random.randint(1, 1000)}
 
 
 # ============================================================
-# WhatsApp Webhook (UPDATED ONLY HERE)
+# WhatsApp Webhook
 # ============================================================
+def send_whatsapp_reply(to_number: str, answer: str):
+    chunks = chunk_text(answer)
+
+    if len(chunks) > 1:
+        twilio_client.messages.create(
+            from_=TWILIO_WHATSAPP_NUMBER,
+            to=to_number,
+            body="📄 The response is long. Sending in multiple messages…",
+        )
+
+    for idx, chunk in enumerate(chunks, start=1):
+        prefix = f"({idx}/{len(chunks)})\n" if len(chunks) > 1 else ""
+        twilio_client.messages.create(
+            from_=TWILIO_WHATSAPP_NUMBER,
+            to=to_number,
+            body=prefix + chunk,
+        )
+
+
+# ------------------------------------------------------------
+# Background replies: the webhook acks immediately, a worker on the
+# whatsapp pool runs the agent and sends the reply. Twilio retries of
+# the same MessageSid are dropped instead of recomputed.
+# ------------------------------------------------------------
+WHATSAPP_DEDUPE_TTL_SECONDS = int(os.getenv("WHATSAPP_DEDUPE_TTL_SECONDS", "3600"))
+
+seen_message_sids = TTLLRUCache(max_entries=10000, ttl_seconds=WHATSAPP_DEDUPE_TTL_SECONDS)
+_seen_message_sids_lock = threading.Lock()
+
+_whatsapp_stats_lock = threading.Lock()
+_whatsapp_stats = {
+    "received": 0, "duplicates": 0, "replied": 0, "failed": 0, "canned_dropped": 0,
+}
+_whatsapp_reply_ms = deque(maxlen=500)
+
+# Canned replies (rate limited, busy, "random") skip the agent, so they go
+# through their own small sender instead of queueing behind agent jobs.
+# Bounded: under overload, excess "busy" replies are dropped, not queued.
+WHATSAPP_CANNED_MAX_PENDING = int(os.getenv("WHATSAPP_CANNED_MAX_PENDING", "20"))
+
+canned_reply_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("WHATSAPP_CANNED_WORKERS", "1")),
+    thread_name_prefix="whatsapp-canned"
+)
+_canned_pending = 0
+
+
+def claim_message_sid(sid: str) -> bool:
+    """
+    True the first time a MessageSid is seen, False for retries.
+    """
+    with _seen_message_sids_lock:
+        if seen_message_sids.get(sid) is not None:
+            return False
+        seen_message_sids.set(sid, True)
+        return True
+
+
+def _count_whatsapp(name: str):
+    with _whatsapp_stats_lock:
+        _whatsapp_stats[name] += 1
+
+
+def process_whatsapp_message(from_number: str, user_message: str, received_at: float, answer: str = None):
+    """
+    Worker job: run the agent (unless a canned answer is given) and
+    send the chunked reply. received_at is the webhook's perf_counter.
+    """
+    try:
+        if answer is None:
+            answer = agent_flights.do(
+                single_flight_key(user_message, "whatsapp", from_number),
+                run_agent, user_message, channel="whatsapp", user_id=from_number
+            )
+
+        if not answer:
+            answer = "Sorry, I could not find an answer to that."
+
+        send_whatsapp_reply(from_number, answer)
+
+        elapsed_ms = round((time.perf_counter() - received_at) * 1000, 2)
+
+        with _whatsapp_stats_lock:
+            _whatsapp_stats["replied"] += 1
+            _whatsapp_reply_ms.append(elapsed_ms)
+
+        logger.info(f"WhatsApp reply sent in {elapsed_ms} ms end-to-end | to={from_number}")
+
+    except Exception:
+        _count_whatsapp("failed")
+        logger.exception("WhatsApp processing failed")
+
+
+def send_canned_reply(from_number: str, user_message: str, received_at: float, answer: str) -> bool:
+    """
+    Queue a canned reply on the bounded sender. False (reply dropped)
+    when WHATSAPP_CANNED_MAX_PENDING replies are already waiting.
+    """
+    global _canned_pending
+
+    with _whatsapp_stats_lock:
+        full = _canned_pending >= WHATSAPP_CANNED_MAX_PENDING
+        if full:
+            _whatsapp_stats["canned_dropped"] += 1
+        else:
+            _canned_pending += 1
+
+    if full:
+        logger.warning(f"WhatsApp canned reply dropped (sender full) | to={from_number}")
+        return False
+
+    def done(_):
+        global _canned_pending
+        with _whatsapp_stats_lock:
+            _canned_pending -= 1
+
+    try:
+        future = canned_reply_executor.submit(
+            process_whatsapp_message, from_number, user_message, received_at, answer
+        )
+    except Exception:
+        done(None)
+        raise
+
+    future.add_done_callback(done)
+    return True
+
+
+def whatsapp_stats() -> dict:
+    with _whatsapp_stats_lock:
+        s = dict(_whatsapp_stats)
+        s["canned_pending"] = _canned_pending
+        latencies = sorted(_whatsapp_reply_ms)
+
+    pool = channel_pools["whatsapp"].stats()
+
+    return {
+        **s,
+        "queue_length": pool["queued"],
+        "in_progress": pool["running"],
+        # End-to-end: webhook received → last reply message sent
+        "avg_reply_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p95_reply_ms": latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else None,
+    }
+
+
 @app.post("/api/v1/whatsapp/webhook")
 async def whatsapp_webhook(request: Request):
+    received_at = time.perf_counter()
+
     if not twilio_client:
         raise HTTPException(status_code=500, detail="Twilio not configured")
 
     form = await request.form()
     user_message = form.get("Body")
     from_number = form.get("From")
+    message_sid = form.get("MessageSid")
 
     if not user_message or not from_number:
         return "OK"
 
-    logger.info(f"WhatsApp message from {from_number}: {user_message}")
-
-    try:
-        if user_message.strip().lower() == "random":
-            answer = f"🎲 Random number: {random.randint(1, 1000)}"
-        else:
-            future = executor.submit(run_agent, user_message)
-            answer = future.result()
+    if message_sid and not claim_message_sid(message_sid):
+        _count_whatsapp("duplicates")
+        logger.info(f"WhatsApp retry ignored | sid={message_sid}")
+        return "OK"
 
-        if not answer:
-            answer = "Sorry, I could not find an answer to that."
+    _count_whatsapp("received")
+    logger.info(f"WhatsApp message from {from_number}: {user_message}")
 
-        chunks = chunk_text(answer)
+    answer = None
 
-        if len(chunks) > 1:
-            twilio_client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=from_number,
-                body="📄 The response is long. Sending in multiple messages…",
-            )
+    if user_message.strip().lower() == "random":
+        answer = f"🎲 Random number: {random.randint(1, 1000)}"
+    else:
+        try:
+            release = admission.admit("whatsapp", from_number)
+        except RateLimited:
+            logger.warning(f"WhatsApp message rate limited | from={from_number}")
+            answer = "⏳ You're sending questions too quickly. Please wait a moment and try again."
+        except Overloaded:
+            logger.warning(f"WhatsApp message shed (server busy) | from={from_number}")
+            answer = "⏳ I'm handling a lot of questions right now. Please try again in a minute."
 
-        for idx, chunk in enumerate(chunks, start=1):
-            prefix = f"({idx}/{len(chunks)})\n" if len(chunks) > 1 else ""
-            twilio_client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=from_number,
-                body=prefix + chunk,
+    try:
+        if answer is not None:
+            send_canned_reply(from_number, user_message, received_at, answer)
+            return "OK"
+
+        # Admitted: the agent job runs on the whatsapp pool
+        try:
+            future = channel_pools["whatsapp"].submit(
+                process_whatsapp_message, from_number, user_message, received_at
             )
+        except Exception:
+            release()
+            raise
 
-        logger.info("WhatsApp reply sent (chunked if required)")
+        future.add_done_callback(lambda _: release())
 
     except Exception:
-        logger.exception("WhatsApp processing failed")
+        logger.exception("WhatsApp job could not be queued")
 
-    return "OK"
\ No newline at end of file
+    return "OK"
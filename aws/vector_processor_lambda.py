@@ -1,11 +1,18 @@
 import json
+import os
+import re
 import boto3
 import uuid
+import random
+import threading
 import traceback
 import time
 import redis
-import struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote_plus
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
 from redis.commands.search.field import TextField, VectorField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
@@ -14,76 +21,344 @@ from redis.commands.search.query import Query
 # CONFIG
 # -----------------------------
 REGION = "eu-west-1"
+# Physical index created on first run; searches go through the alias,
+# which migrations repoint with a single FT.ALIASUPDATE
 REDIS_INDEX_NAME = "doc_index"
+REDIS_INDEX_ALIAS = os.environ.get("REDIS_INDEX_ALIAS", "doc_index_live")
 VECTOR_DIM = 1024
 KEY_PREFIX = "doc:"
 
+# Embedding stage
+EMBED_MAX_IN_FLIGHT = int(os.environ.get("EMBED_MAX_IN_FLIGHT", "8"))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE_SECONDS = float(os.environ.get("EMBED_BACKOFF_BASE_SECONDS", "0.5"))
+EMBED_BACKOFF_MAX_SECONDS = float(os.environ.get("EMBED_BACKOFF_MAX_SECONDS", "20"))
+THROTTLE_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
+# Retried too (botocore retries are off), without shrinking concurrency
+TRANSIENT_ERROR_CODES = ("InternalServerException", "ModelTimeoutException", "ModelNotReadyException")
+
+# Vector index (FLAT = exact brute force, HNSW = approximate graph)
+VECTOR_INDEX_ALGORITHM = os.environ.get("VECTOR_INDEX_ALGORITHM", "FLAT").upper()
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_RUNTIME = int(os.environ.get("HNSW_EF_RUNTIME", "10"))
+
+# Redis write stage
+REDIS_WRITE_BATCH_SIZE = int(os.environ.get("REDIS_WRITE_BATCH_SIZE", "100"))
+
+# Per-document member sets (outside KEY_PREFIX so they are never indexed)
+DOC_MEMBERS_PREFIX = "docmembers:"
+DOC_REGISTRY_KEY = "docregistry"
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", "500"))
+
+# Bumped on every ingest/delete; the API uses it to validate cached answers
+CORPUS_VERSION_KEY = "corpus:version"
+
+# Index the alias pointed at before the last switch, kept for rollback
+# until the next switch (outside KEY_PREFIX)
+RETIRED_INDEX_KEY = "index:retired"
+
 print("Lambda cold start initiated...")
 print(f"Region: {REGION}")
-print(f"Redis Index: {REDIS_INDEX_NAME}")
+print(f"Redis Index: {REDIS_INDEX_NAME} (alias {REDIS_INDEX_ALIAS})")
 
 # -----------------------------
-# AWS CLIENTS
+# LAZY CLIENTS
 # -----------------------------
-s3 = boto3.client("s3")
-textract = boto3.client("textract")
-bedrock = boto3.client("bedrock-runtime")
-secretsmanager = boto3.client("secretsmanager", region_name=REGION)
+# Clients (and the secret) are built on first use: test modes that only
+# touch Redis never pay for S3/Textract, and the cold start report shows
+# what each piece cost. Standalone copy of the API's config.LazyClient.
+COLD_START = time.perf_counter()
+_cold_start_report = {"secrets": {}, "clients": {}}
+
+
+class LazyClient:
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    start = time.perf_counter()
+                    self._client = self._factory()
+                    _cold_start_report["clients"][self._name] = round((time.perf_counter() - start) * 1000, 2)
+        return self._client
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+
+s3 = LazyClient("s3", lambda: boto3.client("s3"))
+textract = LazyClient("textract", lambda: boto3.client("textract"))
+# Retries are handled by the embedding stage so throttling can shrink concurrency
+bedrock = LazyClient("bedrock-runtime", lambda: boto3.client(
+    "bedrock-runtime",
+    config=Config(
+        max_pool_connections=max(EMBED_MAX_IN_FLIGHT, 10),
+        retries={"mode": "standard", "max_attempts": 1}
+    )
+))
+secretsmanager = LazyClient("secretsmanager", lambda: boto3.client("secretsmanager", region_name=REGION))
 
 # -----------------------------
 # SECRETS
 # -----------------------------
+_secrets = {}
+
+
 def get_secrets(secret_name):
-    return json.loads(
-        secretsmanager.get_secret_value(SecretId=secret_name)["SecretString"]
-    )
+    """
+    Memoized per container. APP_SECRET_JSON (e.g. set from the
+    deployment) skips Secrets Manager entirely.
+    """
+    if secret_name not in _secrets:
+        start = time.perf_counter()
+
+        if os.environ.get("APP_SECRET_JSON"):
+            source = "env"
+            _secrets[secret_name] = json.loads(os.environ["APP_SECRET_JSON"])
+        else:
+            source = "secretsmanager"
+            _secrets[secret_name] = json.loads(
+                secretsmanager.get_secret_value(SecretId=secret_name)["SecretString"]
+            )
+
+        _cold_start_report["secrets"][secret_name] = {
+            "source": source,
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    return _secrets[secret_name]
 
-secret = get_secrets("dev/python/api")
 
 # -----------------------------
 # REDIS CONNECTION
 # -----------------------------
-redis_conn = redis.Redis(
-    host=secret["REDIS_HOST"],
-    port=secret["REDIS_PORT"],
-    username=secret["REDIS_USER"],
-    password=secret["REDIS_PASS"],
-    decode_responses=False  # required for binary vectors
-)
+def _connect_redis():
+    secret = get_secrets("dev/python/api")
+    conn = redis.Redis(
+        host=secret["REDIS_HOST"],
+        port=secret["REDIS_PORT"],
+        username=secret["REDIS_USER"],
+        password=secret["REDIS_PASS"],
+        decode_responses=False  # required for binary vectors
+    )
+    print("Redis client initialized.")
+    return conn
 
-print("Redis client initialized.")
+
+redis_conn = LazyClient("redis", _connect_redis)
 
 # -----------------------------
 # REDIS INDEX
 # -----------------------------
-def ensure_redis_index():
+def vector_field(algorithm=VECTOR_INDEX_ALGORITHM, m=HNSW_M,
+                 ef_construction=HNSW_EF_CONSTRUCTION, ef_runtime=HNSW_EF_RUNTIME):
+    attributes = {
+        "TYPE": "FLOAT32",
+        "DIM": VECTOR_DIM,
+        "DISTANCE_METRIC": "COSINE"
+    }
+    if algorithm == "HNSW":
+        attributes.update({
+            "M": m,
+            "EF_CONSTRUCTION": ef_construction,
+            "EF_RUNTIME": ef_runtime
+        })
+    return VectorField("embedding", algorithm, attributes)
+
+
+def create_index(index_name, algorithm=VECTOR_INDEX_ALGORITHM, **hnsw_params):
+    print(f"Creating Redis vector index {index_name} ({algorithm})...")
+    redis_conn.ft(index_name).create_index(
+        fields=[
+            TextField("document_id"),
+            TextField("chunk_id"),
+            TextField("filename"),
+            TextField("text"),
+            vector_field(algorithm, **hnsw_params)
+        ],
+        definition=IndexDefinition(
+            prefix=[KEY_PREFIX],
+            index_type=IndexType.HASH
+        )
+    )
+    print(f"Redis vector index {index_name} created.")
+
+
+def index_exists(name):
+    # FT.INFO also resolves aliases
     try:
-        redis_conn.ft(REDIS_INDEX_NAME).info()
+        redis_conn.ft(name).info()
+        return True
+    except Exception:
+        return False
+
+
+def already_exists(e):
+    # Another cold start (or the API) created it first
+    return isinstance(e, redis.ResponseError) and "already exists" in str(e).lower()
+
+
+def ensure_redis_index():
+    if index_exists(REDIS_INDEX_ALIAS):
         print("Redis index already exists.")
+        return
+    # Deployments from before the alias already have doc_index: alias it
+    if not index_exists(REDIS_INDEX_NAME):
+        try:
+            create_index(REDIS_INDEX_NAME)
+        except Exception as e:
+            if not already_exists(e):
+                raise
+    try:
+        redis_conn.ft(REDIS_INDEX_NAME).aliasadd(REDIS_INDEX_ALIAS)
+        print(f"Alias {REDIS_INDEX_ALIAS} → {REDIS_INDEX_NAME}")
+    except Exception as e:
+        if not already_exists(e):
+            raise
+
+# -----------------------------
+# INDEX MIGRATION (FLAT → HNSW)
+# -----------------------------
+def wait_for_indexing(index_name, timeout_seconds=600, poll_seconds=2):
+    deadline = time.time() + timeout_seconds
+    while True:
+        info = redis_conn.ft(index_name).info()
+        percent = float(info.get("percent_indexed", 1) or 0)
+        indexing = str(info.get("indexing", "0"))
+        print(f"Index {index_name}: {round(percent * 100, 1)}% indexed")
+        if percent >= 1 and indexing == "0":
+            return info
+        if time.time() > deadline:
+            raise Exception(f"Index {index_name} still building after {timeout_seconds}s")
+        time.sleep(poll_seconds)
+
+
+def sample_query_vectors(sample_size):
+    vectors = []
+    for key in redis_conn.scan_iter(match=f"{KEY_PREFIX}*", count=500):
+        vec = redis_conn.hget(key, "embedding")
+        if vec and len(vec) == VECTOR_DIM * 4:
+            vectors.append(vec)
+        if len(vectors) >= sample_size:
+            break
+    return vectors
+
+
+def knn_ids(index_name, vec, k, ef_runtime=None):
+    clause = f"KNN {k} @embedding $vec"
+    params = {"vec": vec}
+    if ef_runtime:
+        clause += " EF_RUNTIME $ef"
+        params["ef"] = ef_runtime
+    q = Query(f"*=>[{clause}]").no_content().dialect(2).paging(0, k)
+    start = time.perf_counter()
+    result = redis_conn.ft(index_name).search(q, query_params=params)
+    return [d.id for d in result.docs], (time.perf_counter() - start) * 1000
+
+
+def compare_indexes(baseline_index, candidate_index, k=10, sample_size=50, ef_values=(10, 50, 100, 200)):
+    """
+    recall@k of the candidate index against the baseline (treated as
+    ground truth, exact when it is FLAT) plus latency per EF_RUNTIME.
+    Query vectors are sampled from stored chunks.
+    """
+    vectors = sample_query_vectors(sample_size)
+    if not vectors:
+        return {"samples": 0, "message": "No stored vectors to sample"}
+
+    def summarize(latencies):
+        ordered = sorted(latencies)
+        return {
+            "avg_ms": round(sum(ordered) / len(ordered), 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2)
+        }
+
+    truth = []
+    base_lat = []
+    for vec in vectors:
+        ids, ms = knn_ids(baseline_index, vec, k)
+        truth.append(set(ids))
+        base_lat.append(ms)
+
+    report = {
+        "samples": len(vectors),
+        "k": k,
+        "baseline": {"index": baseline_index, **summarize(base_lat)},
+        "candidate": []
+    }
+
+    for ef in ef_values:
+        hits = 0
+        expected = 0
+        lat = []
+        for vec, true_ids in zip(vectors, truth):
+            ids, ms = knn_ids(candidate_index, vec, k, ef_runtime=ef)
+            hits += len(true_ids & set(ids))
+            expected += len(true_ids)
+            lat.append(ms)
+        report["candidate"].append({
+            "index": candidate_index,
+            "ef_runtime": ef,
+            f"recall@{k}": round(hits / expected, 4) if expected else 0.0,
+            **summarize(lat)
+        })
+
+    print("Index comparison report:", json.dumps(report))
+    return report
+
+
+def switch_alias(alias, target_index):
+    """
+    Point `alias` at target_index with one atomic FT.ALIASUPDATE, so
+    searches through the alias never see a missing index. The index it
+    pointed at is kept for rollback (switch back to it) until the next
+    switch, which drops it (documents are kept).
+    """
+    current = redis_conn.ft(alias).info().get("index_name")
+
+    if current != target_index:
+        redis_conn.ft(target_index).aliasupdate(alias)
+
+        retired = redis_conn.get(RETIRED_INDEX_KEY)
+        retired = retired.decode() if isinstance(retired, bytes) else retired
+        if retired and retired not in (target_index, current):
+            redis_conn.ft(retired).dropindex(delete_documents=False)
+            print(f"Dropped index {retired}")
+
+        redis_conn.set(RETIRED_INDEX_KEY, current)
+
+    print(f"Alias {alias} → {target_index} (previous: {current})")
+    return current
+
+
+def migrate_index(target_index, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                  ef_runtime=HNSW_EF_RUNTIME, switch=False, k=10, sample_size=50):
+    """
+    Build an HNSW index over the same keys next to the live one, wait
+    for the backfill, report recall/latency, and optionally switch the
+    REDIS_INDEX_ALIAS over to it.
+    """
+    try:
+        redis_conn.ft(target_index).info()
+        print(f"Index {target_index} already exists, reusing it.")
     except Exception:
-        print("Creating Redis vector index...")
-        redis_conn.ft(REDIS_INDEX_NAME).create_index(
-            fields=[
-                TextField("document_id"),
-                TextField("chunk_id"),
-                TextField("filename"),
-                TextField("text"),
-                VectorField(
-                    "embedding",
-                    "FLAT",
-                    {
-                        "TYPE": "FLOAT32",
-                        "DIM": VECTOR_DIM,
-                        "DISTANCE_METRIC": "COSINE"
-                    }
-                )
-            ],
-            definition=IndexDefinition(
-                prefix=[KEY_PREFIX],
-                index_type=IndexType.HASH
-            )
-        )
-        print("Redis vector index created.")
+        create_index(target_index, "HNSW", m=m, ef_construction=ef_construction, ef_runtime=ef_runtime)
+
+    wait_for_indexing(target_index)
+
+    report = compare_indexes(REDIS_INDEX_ALIAS, target_index, k=k, sample_size=sample_size,
+                             ef_values=sorted({ef_runtime, 10, 50, 100, 200}))
+
+    previous = switch_alias(REDIS_INDEX_ALIAS, target_index) if switch else None
+
+    return {"target_index": target_index, "switched": bool(switch), "previous_index": previous, "report": report}
 
 # -----------------------------
 # TEXTRACT (ASYNC)
@@ -127,6 +402,25 @@ def chunk_text(text, size=1000, overlap=200):
     print(f"Created {len(chunks)} chunks.")
     return chunks
 
+# -----------------------------
+# LEXICAL FEATURES
+# -----------------------------
+# Keep in sync with lexical_features.py (query-time scoring)
+def tokenize(text):
+    text = re.sub(r"[^a-z0-9]", " ", text.lower())
+    return [t for t in text.split() if len(t) > 1]
+
+
+def chunk_features(text):
+    counts = {}
+    for t in tokenize(text):
+        counts[t] = counts.get(t, 0) + 1
+    return {
+        "token_counts": json.dumps(counts, separators=(",", ":")),
+        "token_count": sum(counts.values()),
+        "numeric_count": len(re.findall(r"\d+", text))
+    }
+
 # -----------------------------
 # EMBEDDING
 # -----------------------------
@@ -137,43 +431,214 @@ def get_embedding(text):
         accept="application/json",
         body=json.dumps({"inputText": text})
     )
-    embedding = json.loads(response["body"].read())["embedding"]
+    # One C-level conversion into a float32 buffer (no struct splat later)
+    embedding = array("f", json.loads(response["body"].read())["embedding"])
     print(f"Embedding dimension: {len(embedding)}")
     return embedding
 
 # -----------------------------
-# FLOAT LIST → BYTES (NO NUMPY)
+# CONCURRENT EMBEDDING STAGE
+# -----------------------------
+class AdaptiveLimiter:
+    """
+    Caps in-flight Bedrock calls. Halves the limit on throttling and
+    grows it back by one per success (AIMD), never above max_limit.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.throttles = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self.limit = max(1, self.limit // 2)
+            elif self.limit < self.max_limit:
+                self.limit += 1
+            self._cond.notify_all()
+
+
+def is_throttle_error(e):
+    return (
+        isinstance(e, ClientError)
+        and e.response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES
+    )
+
+
+def is_transient_error(e):
+    if isinstance(e, (ConnectionError, ReadTimeoutError)):
+        return True
+    return (
+        isinstance(e, ClientError)
+        and e.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+    )
+
+
+def get_embedding_with_backoff(text, limiter):
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        limiter.acquire()
+        throttled = False
+        try:
+            return get_embedding(text)
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            if not (throttled or is_transient_error(e)) or attempt == EMBED_MAX_RETRIES:
+                raise
+        finally:
+            limiter.release(throttled=throttled)
+
+        # Full jitter exponential backoff
+        delay = min(EMBED_BACKOFF_MAX_SECONDS, EMBED_BACKOFF_BASE_SECONDS * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+
+def embed_chunks(chunks, max_in_flight=EMBED_MAX_IN_FLIGHT):
+    """
+    Embed all chunks with bounded concurrency. Results keep chunk order.
+    """
+    if not chunks:
+        return []
+
+    limiter = AdaptiveLimiter(max_in_flight)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as pool:
+        embeddings = list(pool.map(lambda c: get_embedding_with_backoff(c, limiter), chunks))
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Embedded {len(chunks)} chunks in {round(elapsed, 2)} s "
+        f"({round(len(chunks) / elapsed, 2) if elapsed else len(chunks)} chunks/sec, "
+        f"max_in_flight={limiter.max_limit}, final_limit={limiter.limit}, throttles={limiter.throttles})"
+    )
+    return embeddings
+
+# -----------------------------
+# FLOAT32 BUFFER → BYTES (NO NUMPY)
 # -----------------------------
 def to_float32_bytes(vector):
-    return struct.pack(f"{len(vector)}f", *vector)
+    if not isinstance(vector, array) or vector.typecode != "f":
+        vector = array("f", vector)
+    return vector.tobytes()
+
+# -----------------------------
+# BULK REDIS WRITES
+# -----------------------------
+def write_chunk_records(records, batch_size=REDIS_WRITE_BATCH_SIZE):
+    """
+    Write (key, mapping) records through a non-transactional pipeline,
+    one round trip per batch. Each key is also added to its document's
+    member set so deletes never need KEYS. Returns per-batch timings.
+    """
+    batch_size = max(1, batch_size)
+    batches = []
+
+    for offset in range(0, len(records), batch_size):
+        batch = records[offset:offset + batch_size]
+        start = time.perf_counter()
+
+        pipe = redis_conn.pipeline(transaction=False)
+        for key, mapping in batch:
+            pipe.hset(key, mapping=mapping)
+            pipe.sadd(f"{DOC_MEMBERS_PREFIX}{mapping['document_id']}", key)
+            pipe.sadd(DOC_REGISTRY_KEY, mapping["document_id"])
+        pipe.execute()
+
+        batches.append({
+            "batch": len(batches),
+            "records": len(batch),
+            "ms": round((time.perf_counter() - start) * 1000, 2)
+        })
+
+    if records:
+        redis_conn.incr(CORPUS_VERSION_KEY)
+
+    total_ms = round(sum(b["ms"] for b in batches), 2)
+    print(f"Wrote {len(records)} records in {len(batches)} batches ({total_ms} ms, batch_size={batch_size})")
+    return batches
 
 # -----------------------------
 # DELETE UTILITIES
 # -----------------------------
+def unlink_in_batches(keys, batch_size=DELETE_BATCH_SIZE):
+    """
+    UNLINK keys from any iterable in fixed-size batches. UNLINK frees
+    memory in the background, so no single call stalls the server.
+    """
+    batch_size = max(1, batch_size)
+    batch = []
+    deleted = 0
+
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += redis_conn.unlink(*batch)
+            batch = []
+
+    if batch:
+        deleted += redis_conn.unlink(*batch)
+
+    return deleted
+
+
 def delete_vectors_by_document_id(document_id):
-    pattern = f"{KEY_PREFIX}{document_id}:*"
-    keys = redis_conn.keys(pattern)
+    members_key = f"{DOC_MEMBERS_PREFIX}{document_id}"
+
+    if redis_conn.exists(members_key):
+        deleted = unlink_in_batches(redis_conn.sscan_iter(members_key, count=DELETE_BATCH_SIZE))
+    else:
+        # Legacy document ingested before member sets existed
+        deleted = unlink_in_batches(
+            redis_conn.scan_iter(match=f"{KEY_PREFIX}{document_id}:*", count=DELETE_BATCH_SIZE)
+        )
+
+    redis_conn.unlink(members_key)
+    redis_conn.srem(DOC_REGISTRY_KEY, document_id)
 
-    if not keys:
+    if not deleted:
         print(f"No vectors found for document_id={document_id}")
         return 0
 
-    redis_conn.delete(*keys)
-    print(f"Deleted {len(keys)} chunks for document_id={document_id}")
-    return len(keys)
+    redis_conn.incr(CORPUS_VERSION_KEY)
+
+    print(f"Deleted {deleted} chunks for document_id={document_id}")
+    return deleted
 
 
 def delete_vectors_by_doc_all():
-    pattern = f"{KEY_PREFIX}*"
-    keys = redis_conn.keys(pattern)
+    deleted = 0
+
+    for document_id in list(redis_conn.sscan_iter(DOC_REGISTRY_KEY, count=DELETE_BATCH_SIZE)):
+        if isinstance(document_id, bytes):
+            document_id = document_id.decode()
+        deleted += delete_vectors_by_document_id(document_id)
 
-    if not keys:
+    # Sweep any legacy chunks that were never registered
+    legacy = unlink_in_batches(
+        redis_conn.scan_iter(match=f"{KEY_PREFIX}*", count=DELETE_BATCH_SIZE)
+    )
+    deleted += legacy
+
+    if not deleted:
         print("No vectors found in Redis.")
         return 0
 
-    redis_conn.delete(*keys)
-    print(f"Deleted ALL vectors. Count={len(keys)}")
-    return len(keys)
+    if legacy:
+        redis_conn.incr(CORPUS_VERSION_KEY)
+
+    print(f"Deleted ALL vectors. Count={deleted}")
+    return deleted
 
 # -----------------------------
 # LAMBDA HANDLER
@@ -186,26 +651,41 @@ def lambda_handler(event, context):
     try:
         ensure_redis_index()
 
+        if _cold_start_report.get("reported") is None:
+            _cold_start_report["reported"] = True
+            print(
+                f"Cold start report: {round((time.perf_counter() - COLD_START) * 1000, 2)} ms since init | "
+                f"secrets={_cold_start_report['secrets']} clients={_cold_start_report['clients']}"
+            )
+
         # =========================
         # MANUAL TEST MODES
         # =========================
         if event.get("test_mode") == "vector_insert":
             vector_bytes = to_float32_bytes([0.1] * VECTOR_DIM)
-            redis_conn.hset(
-                f"{KEY_PREFIX}manual-test:1",
-                mapping={
-                    "document_id": "manual-test",
-                    "chunk_id": "1",
-                    "filename": "manual.txt",
-                    "text": "Test document about finance and insurance.",
-                    "embedding": vector_bytes
-                }
+            count = int(event.get("count", 1))
+            records = [
+                (
+                    f"{KEY_PREFIX}manual-test:{i + 1}",
+                    {
+                        "document_id": "manual-test",
+                        "chunk_id": str(i + 1),
+                        "filename": "manual.txt",
+                        "text": "Test document about finance and insurance.",
+                        "embedding": vector_bytes,
+                        **chunk_features("Test document about finance and insurance.")
+                    }
+                )
+                for i in range(count)
+            ]
+            batches = write_chunk_records(
+                records, int(event.get("batch_size", REDIS_WRITE_BATCH_SIZE))
             )
-            return {"statusCode": 200, "message": "Dummy vector inserted"}
+            return {"statusCode": 200, "message": f"{count} dummy vector(s) inserted", "batches": batches}
 
         if event.get("test_mode") == "fetch_all":
             q = Query("*").return_fields("document_id", "filename", "text").paging(0, 10)
-            result = redis_conn.ft(REDIS_INDEX_NAME).search(q)
+            result = redis_conn.ft(REDIS_INDEX_ALIAS).search(q)
             return {"total": result.total, "docs": [d.__dict__ for d in result.docs]}
 
         if event.get("test_mode") == "vector_search":
@@ -215,11 +695,33 @@ def lambda_handler(event, context):
                 .return_fields("filename", "text", "__embedding_score")
                 .dialect(2)
             )
-            result = redis_conn.ft(REDIS_INDEX_NAME).search(
+            result = redis_conn.ft(REDIS_INDEX_ALIAS).search(
                 q, query_params={"vec": query_vec}
             )
             return {"results": [d.__dict__ for d in result.docs]}
 
+        if event.get("test_mode") == "migrate_index":
+            result = migrate_index(
+                event.get("target_index", f"{REDIS_INDEX_NAME}_hnsw"),
+                m=int(event.get("m", HNSW_M)),
+                ef_construction=int(event.get("ef_construction", HNSW_EF_CONSTRUCTION)),
+                ef_runtime=int(event.get("ef_runtime", HNSW_EF_RUNTIME)),
+                switch=bool(event.get("switch", False)),
+                k=int(event.get("k", 10)),
+                sample_size=int(event.get("samples", 50))
+            )
+            return {"statusCode": 200, **result}
+
+        if event.get("test_mode") == "index_report":
+            report = compare_indexes(
+                event.get("baseline_index", REDIS_INDEX_ALIAS),
+                event["candidate_index"],
+                k=int(event.get("k", 10)),
+                sample_size=int(event.get("samples", 50)),
+                ef_values=tuple(event.get("ef_values", (10, 50, 100, 200)))
+            )
+            return {"statusCode": 200, "report": report}
+
         if event.get("test_mode") == "delete_vector":
             document_id = event.get("document_id")
             if not document_id:
@@ -247,18 +749,24 @@ def lambda_handler(event, context):
                 document_id = str(uuid.uuid4())
                 filename = key.split("/")[-1]
 
-                for i, chunk in enumerate(chunks):
-                    embedding = get_embedding(chunk)
-                    redis_conn.hset(
+                embeddings = embed_chunks(chunks)
+
+                records = [
+                    (
                         f"{KEY_PREFIX}{document_id}:{i}",
-                        mapping={
+                        {
                             "document_id": document_id,
                             "chunk_id": f"{document_id}_{i}",
                             "filename": filename,
                             "text": chunk,
-                            "embedding": to_float32_bytes(embedding)
+                            "embedding": to_float32_bytes(embedding),
+                            **chunk_features(chunk)
                         }
                     )
+                    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+                ]
+
+                write_chunk_records(records)
 
             return {"statusCode": 200}
 
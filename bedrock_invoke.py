@@ -0,0 +1,429 @@
+# bedrock_invoke.py
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from botocore.exceptions import ClientError, ReadTimeoutError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+BEDROCK_DEADLINE_SECONDS = float(os.getenv("BEDROCK_DEADLINE_SECONDS", "30"))
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "5"))
+BEDROCK_BACKOFF_BASE_SECONDS = float(os.getenv("BEDROCK_BACKOFF_BASE_SECONDS", "0.25"))
+BEDROCK_BACKOFF_MAX_SECONDS = float(os.getenv("BEDROCK_BACKOFF_MAX_SECONDS", "8"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BEDROCK_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BEDROCK_BREAKER_RESET_SECONDS", "30"))
+
+HEDGE_MIN_SAMPLES = int(os.getenv("BEDROCK_HEDGE_MIN_SAMPLES", "20"))
+# Every attempt runs on this pool so it can be bounded by the deadline
+CALL_WORKERS = int(os.getenv("BEDROCK_CALL_WORKERS", "32"))
+
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+
+
+# ============================================================
+# ERRORS
+# ============================================================
+
+class CircuitOpen(Exception):
+    """
+    Raised without calling Bedrock while a model's breaker is open.
+    """
+
+
+def is_retryable(e: Exception) -> bool:
+
+    if isinstance(e, ClientError):
+        return e.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+
+    return isinstance(e, (BotoConnectionError, ReadTimeoutError, TimeoutError))
+
+
+# ============================================================
+# CIRCUIT BREAKER
+# ============================================================
+
+class CircuitBreaker:
+    """
+    closed → open after N consecutive retryable failures
+    open → half_open after reset_seconds (one trial call)
+    half_open → closed on success, open again on failure
+    Non-retryable errors (bad request etc.) say nothing about health:
+    they only free the half-open trial slot.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+
+        with self._lock:
+
+            if self.state == "open":
+
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    raise CircuitOpen("Bedrock circuit open")
+
+                self.state = "half_open"
+                self._trial_in_flight = False
+
+            if self.state == "half_open":
+
+                if self._trial_in_flight:
+                    raise CircuitOpen("Bedrock circuit half-open, trial in flight")
+
+                self._trial_in_flight = True
+
+    def record_success(self):
+
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+
+        with self._lock:
+
+            self.failures += 1
+            self._trial_in_flight = False
+
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+
+                if self.state != "open":
+                    self.times_opened += 1
+
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+            }
+
+
+# ============================================================
+# PER-MODEL STATE
+# ============================================================
+
+class ModelState:
+
+    def __init__(self):
+
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=500)
+        self.counts = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0, "hedges": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+
+        with self._lock:
+            self.latencies.append(ms)
+
+    def count(self, name: str):
+
+        with self._lock:
+            self.counts[name] += 1
+
+    def p95_ms(self):
+
+        with self._lock:
+
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+
+            ordered = sorted(self.latencies)
+
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def snapshot(self):
+
+        p95 = self.p95_ms()
+
+        with self._lock:
+            counts = dict(self.counts)
+
+        counts["hedge_win_rate"] = round(counts["hedge_wins"] / counts["hedges"], 3) if counts["hedges"] else 0.0
+
+        return {
+            **self.breaker.snapshot(),
+            **counts,
+            "p95_ms": round(p95, 2) if p95 is not None else None,
+        }
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+_call_executor = ThreadPoolExecutor(max_workers=CALL_WORKERS, thread_name_prefix="bedrock-call")
+
+
+def _model(model_id: str) -> ModelState:
+
+    with _models_lock:
+
+        if model_id not in _models:
+            _models[model_id] = ModelState()
+
+        return _models[model_id]
+
+
+def get_bedrock_stats():
+
+    with _models_lock:
+        models = dict(_models)
+
+    return {model_id: state.snapshot() for model_id, state in models.items()}
+
+
+# ============================================================
+# SINGLE ATTEMPT (OPTIONALLY HEDGED)
+# ============================================================
+
+def _timed(state: ModelState, call):
+
+    start = time.perf_counter()
+    result = call()
+    state.observe((time.perf_counter() - start) * 1000)
+
+    return result
+
+
+def _attempt(state: ModelState, call, hedge: bool, remaining: float):
+
+    if remaining <= 0:
+        raise TimeoutError("Bedrock call deadline exceeded")
+
+    p95 = state.p95_ms() if hedge else None
+
+    primary = _call_executor.submit(_timed, state, call)
+
+    if p95 is None:
+        # A hung call is abandoned at the deadline. Before 3.11 the
+        # futures TimeoutError is not the builtin one is_retryable checks
+        try:
+            return primary.result(timeout=remaining)
+        except FutureTimeoutError:
+            raise TimeoutError("Bedrock call deadline exceeded") from None
+
+    # Hedge: if the first request is slower than p95, race a duplicate
+
+    done, _ = wait([primary], timeout=min(p95 / 1000, remaining))
+
+    if done:
+        return primary.result()
+
+    state.count("hedges")
+
+    duplicate = _call_executor.submit(_timed, state, call)
+
+    pending = {primary, duplicate}
+    deadline = time.monotonic() + max(0.0, remaining - p95 / 1000)
+    error = None
+
+    while pending:
+
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+        if not done:
+            raise TimeoutError("Bedrock hedged call exceeded deadline")
+
+        for f in done:
+
+            if f.exception() is None:
+
+                if f is duplicate:
+                    state.count("hedge_wins")
+
+                return f.result()
+
+            error = f.exception()
+
+    raise error
+
+
+async def _aattempt(state: ModelState, acall, remaining: float):
+
+    if remaining <= 0:
+        raise TimeoutError("Bedrock call deadline exceeded")
+
+    start = time.perf_counter()
+
+    try:
+        result = await asyncio.wait_for(acall(), timeout=remaining)
+    except asyncio.TimeoutError:
+        # Not the builtin TimeoutError before 3.11
+        raise TimeoutError("Bedrock call deadline exceeded") from None
+
+    state.observe((time.perf_counter() - start) * 1000)
+
+    return result
+
+
+# ============================================================
+# PUBLIC WRAPPER
+# ============================================================
+
+def _retry_delay(state: ModelState, e: Exception, attempt: int, max_attempts: int, deadline: float):
+    """
+    Record a failed attempt. Returns the backoff before the next one,
+    or None when e should be raised.
+    """
+
+    retryable = is_retryable(e)
+
+    if retryable:
+        state.breaker.record_failure()
+    else:
+        state.breaker.release_trial()
+
+    if not retryable or attempt == max_attempts - 1:
+        state.count("failures")
+        return None
+
+    delay = random.uniform(
+        0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    )
+
+    if time.monotonic() + delay >= deadline:
+        state.count("failures")
+        return None
+
+    state.count("retries")
+
+    return delay
+
+
+def invoke_with_resilience(
+    model_id: str,
+    call,
+    *,
+    hedge: bool = False,
+    deadline_seconds: float = BEDROCK_DEADLINE_SECONDS,
+    max_attempts: int = BEDROCK_MAX_ATTEMPTS
+):
+    """
+    Run call() (one complete Bedrock request, body read included) with:
+    - a circuit breaker per model id (CircuitOpen when open)
+    - full-jitter exponential retry on throttling / 5xx / timeouts
+    - an overall deadline across all attempts
+    - optional hedging: a duplicate request once the first one is
+      slower than the model's observed p95 (idempotent calls only)
+    """
+
+    state = _model(model_id)
+    deadline = time.monotonic() + deadline_seconds
+
+    state.count("calls")
+
+    for attempt in range(max_attempts):
+
+        try:
+            state.breaker.allow()
+        except CircuitOpen:
+            state.count("rejected")
+            raise
+
+        try:
+
+            result = _attempt(state, call, hedge, deadline - time.monotonic())
+
+        except Exception as e:
+
+            delay = _retry_delay(state, e, attempt, max_attempts, deadline)
+
+            if delay is None:
+                raise
+
+            time.sleep(delay)
+            continue
+
+        state.breaker.record_success()
+
+        return result
+
+
+async def ainvoke_with_resilience(
+    model_id: str,
+    acall,
+    *,
+    deadline_seconds: float = BEDROCK_DEADLINE_SECONDS,
+    max_attempts: int = BEDROCK_MAX_ATTEMPTS
+):
+    """
+    Async invoke_with_resilience: acall() is a coroutine function,
+    awaited on the event loop (no thread per call). Same breaker, retry
+    policy, deadline and stats per model id; no hedging.
+    """
+
+    state = _model(model_id)
+    deadline = time.monotonic() + deadline_seconds
+
+    state.count("calls")
+
+    for attempt in range(max_attempts):
+
+        try:
+            state.breaker.allow()
+        except CircuitOpen:
+            state.count("rejected")
+            raise
+
+        try:
+
+            result = await _aattempt(state, acall, deadline - time.monotonic())
+
+        except asyncio.CancelledError:
+            # Caller went away: says nothing about Bedrock's health
+            state.breaker.release_trial()
+            raise
+
+        except Exception as e:
+
+            delay = _retry_delay(state, e, attempt, max_attempts, deadline)
+
+            if delay is None:
+                raise
+
+            await asyncio.sleep(delay)
+            continue
+
+        state.breaker.record_success()
+
+        return result
@@ -0,0 +1,284 @@
+# cache_utils.py
+
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from vector_utils import to_float32_bytes, from_float32_bytes
+
+
+# ============================================================
+# TEXT NORMALIZATION
+# ============================================================
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form used for cache keys: trimmed, casefolded,
+    single-spaced.
+    """
+
+    return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+
+# ============================================================
+# IN-PROCESS TTL + LRU CACHE
+# ============================================================
+
+class TTLLRUCache:
+    """
+    Thread-safe LRU cache with a max entry count, a per-entry TTL and
+    an optional total size bound (max_bytes, measured by sizeof).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        max_bytes: int = None,
+        sizeof=None
+    ):
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or _default_sizeof
+
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _evict(self, key):
+
+        _, _, size = self._data.pop(key)
+
+        self._bytes -= size
+
+    def get(self, key):
+
+        with self._lock:
+
+            item = self._data.get(key)
+
+            if item is None:
+                return None
+
+            value, expires_at, _ = item
+
+            if expires_at < time.monotonic():
+                self._evict(key)
+                return None
+
+            self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+
+        size = self.sizeof(value) if self.max_bytes else 0
+
+        # Never let one oversized value flush the whole cache
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self._lock:
+
+            if key in self._data:
+                self._evict(key)
+
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds, size)
+            self._bytes += size
+
+            while len(self._data) > self.max_entries or (
+                self.max_bytes and self._bytes > self.max_bytes
+            ):
+                self._evict(next(iter(self._data)))
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    @property
+    def size_bytes(self):
+
+        return self._bytes
+
+    def __len__(self):
+
+        return len(self._data)
+
+
+def _default_sizeof(value):
+
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+
+    return sys.getsizeof(value)
+
+
+# ============================================================
+# TWO-TIER QUERY EMBEDDING CACHE
+# ============================================================
+
+class EmbeddingCache:
+    """
+    Query embedding cache:
+    - Tier 1: in-process TTL + LRU (no network)
+    - Tier 2: shared Redis, packed float32 bytes
+    - Miss: calls embed_fn and fills both tiers
+    """
+
+    def __init__(
+        self,
+        embed_fn,
+        redis_conn=None,
+        *,
+        namespace: str = "default",
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        redis_ttl_seconds: int = 7 * 24 * 3600,
+        key_prefix: str = "embcache:"
+    ):
+
+        self.embed_fn = embed_fn
+        self.redis_conn = redis_conn
+        self.namespace = namespace
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self.key_prefix = key_prefix
+
+        self.local = TTLLRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "redis_errors": 0,
+            "local_hit_ms": 0.0,
+            "redis_hit_ms": 0.0,
+            "miss_ms": 0.0,
+        }
+
+    # --------------------------------------------------------
+    # KEYS / SERIALIZATION
+    # --------------------------------------------------------
+
+    def _redis_key(self, normalized: str) -> str:
+
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+        return f"{self.key_prefix}{self.namespace}:{digest}"
+
+    @staticmethod
+    def _pack(vector):
+
+        return to_float32_bytes(vector)
+
+    @staticmethod
+    def _unpack(raw: bytes):
+
+        return from_float32_bytes(raw)
+
+    def _record(self, counter: str, timer: str, started: float):
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self._stats[counter] += 1
+            self._stats[timer] += elapsed_ms
+
+    # --------------------------------------------------------
+    # LOOKUP
+    # --------------------------------------------------------
+
+    def get(self, text: str):
+
+        started = time.perf_counter()
+
+        normalized = normalize_text(text)
+
+        vector = self.local.get(normalized)
+
+        if vector is not None:
+            self._record("local_hits", "local_hit_ms", started)
+            return vector
+
+        redis_key = self._redis_key(normalized)
+
+        if self.redis_conn is not None:
+
+            try:
+
+                raw = self.redis_conn.get(redis_key)
+
+                if raw:
+                    vector = self._unpack(raw)
+                    self.local.set(normalized, vector)
+                    self._record("redis_hits", "redis_hit_ms", started)
+                    return vector
+
+            except Exception as e:
+
+                with self._lock:
+                    self._stats["redis_errors"] += 1
+
+                print("Embedding cache Redis lookup failed:", str(e))
+
+        vector = self.embed_fn(text)
+
+        self.local.set(normalized, vector)
+
+        if self.redis_conn is not None:
+
+            try:
+
+                self.redis_conn.set(
+                    redis_key,
+                    self._pack(vector),
+                    ex=self.redis_ttl_seconds
+                )
+
+            except Exception as e:
+
+                with self._lock:
+                    self._stats["redis_errors"] += 1
+
+                print("Embedding cache Redis store failed:", str(e))
+
+        self._record("misses", "miss_ms", started)
+
+        return vector
+
+    # --------------------------------------------------------
+    # METRICS
+    # --------------------------------------------------------
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            s = dict(self._stats)
+
+        lookups = s["local_hits"] + s["redis_hits"] + s["misses"]
+
+        def avg(total, count):
+            return round(total / count, 3) if count else 0.0
+
+        return {
+            "lookups": lookups,
+            "local_hits": s["local_hits"],
+            "redis_hits": s["redis_hits"],
+            "misses": s["misses"],
+            "redis_errors": s["redis_errors"],
+            "hit_rate": round((s["local_hits"] + s["redis_hits"]) / lookups, 3) if lookups else 0.0,
+            "avg_local_hit_ms": avg(s["local_hit_ms"], s["local_hits"]),
+            "avg_redis_hit_ms": avg(s["redis_hit_ms"], s["redis_hits"]),
+            "avg_miss_ms": avg(s["miss_ms"], s["misses"]),
+            "local_entries": len(self.local),
+        }
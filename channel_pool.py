@@ -0,0 +1,107 @@
+# channel_pool.py
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ============================================================
+# PER-CHANNEL EXECUTOR
+# ============================================================
+
+class ChannelPool:
+    """
+    Dedicated thread pool for one channel (rest, whatsapp, ...).
+
+    submit() offloads blocking agent work to the pool (callers await it
+    via asyncio.wrap_future) so the event loop stays free, and each channel
+    has its own workers so a burst on one can't starve another.
+    Tracks queue depth and time spent waiting for a worker.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"agent-{name}"
+        )
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._waits_ms = deque(maxlen=500)
+        self._stats = {
+            "completed": 0,
+            "failed": 0,
+            "run_ms_total": 0.0,
+        }
+
+    def _execute(self, submitted: float, fn, args, kwargs):
+
+        started = time.perf_counter()
+        wait_ms = (started - submitted) * 1000
+
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._waits_ms.append(wait_ms)
+
+        ok = False
+
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._stats["completed" if ok else "failed"] += 1
+                self._stats["run_ms_total"] += (time.perf_counter() - started) * 1000
+
+    def submit(self, fn, *args, **kwargs):
+
+        with self._lock:
+            self._queued += 1
+
+        future = self.executor.submit(self._execute, time.perf_counter(), fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+
+        return future
+
+    def _on_done(self, future):
+
+        # Cancelled while still queued (caller went away): never started
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            s = dict(self._stats)
+            waits = sorted(self._waits_ms)
+            queued = self._queued
+            running = self._running
+
+        finished = s["completed"] + s["failed"]
+
+        return {
+            "workers": self.max_workers,
+            "queued": queued,
+            "running": running,
+            "completed": s["completed"],
+            "failed": s["failed"],
+            # Wait figures cover the most recent 500 requests
+            "avg_wait_ms": round(sum(waits) / len(waits), 2) if waits else 0.0,
+            "p95_wait_ms": round(waits[int(len(waits) * 0.95) - 1], 2) if len(waits) >= 20 else None,
+            "max_wait_ms": round(waits[-1], 2) if waits else 0.0,
+            "avg_run_ms": round(s["run_ms_total"] / finished, 2) if finished else 0.0,
+        }
+
+    def shutdown(self):
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,194 @@
+# config.py
+
+import json
+import os
+import threading
+import time
+
+import boto3
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+REGION = "eu-west-1"
+SECRET_NAME = os.getenv("APP_SECRET_NAME", "dev/python/api")
+
+# Optional shortcuts around Secrets Manager:
+# - APP_SECRET_JSON: the secret's JSON, e.g. injected by the container
+# - SECRETS_CACHE_FILE: on-disk copy reused for SECRETS_CACHE_TTL_SECONDS
+SECRETS_CACHE_FILE = os.getenv("SECRETS_CACHE_FILE")
+SECRETS_CACHE_TTL_SECONDS = int(os.getenv("SECRETS_CACHE_TTL_SECONDS", "3600"))
+
+PROCESS_START = time.perf_counter()
+
+_secrets = {}
+_secrets_lock = threading.Lock()
+
+_startup_lock = threading.Lock()
+_startup = {
+    "secrets": {},
+    "clients": {},
+}
+
+
+def _record(section: str, name: str, value):
+
+    with _startup_lock:
+        _startup[section][name] = value
+
+
+# ============================================================
+# SECRETS
+# ============================================================
+
+def _read_cache_file(secret_name: str):
+
+    if not SECRETS_CACHE_FILE:
+        return None
+
+    try:
+        if time.time() - os.path.getmtime(SECRETS_CACHE_FILE) > SECRETS_CACHE_TTL_SECONDS:
+            return None
+
+        with open(SECRETS_CACHE_FILE) as f:
+            return json.load(f).get(secret_name)
+
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache_file(secret_name: str, value: dict):
+
+    if not SECRETS_CACHE_FILE:
+        return
+
+    try:
+        # Owner-only: the file holds credentials
+        fd = os.open(SECRETS_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({secret_name: value}, f)
+
+    except OSError as e:
+        print(f"⚠️ SECRETS CACHE WRITE FAILED: {e}")
+
+
+def get_secret(secret_name: str = SECRET_NAME) -> dict:
+    """
+    Memoized secret lookup: APP_SECRET_JSON env → fresh on-disk cache
+    → Secrets Manager. At most one fetch per process per secret.
+    """
+
+    value = _secrets.get(secret_name)
+
+    if value is not None:
+        return value
+
+    with _secrets_lock:
+
+        if secret_name in _secrets:
+            return _secrets[secret_name]
+
+        start = time.perf_counter()
+        source = "env"
+
+        value = json.loads(os.environ["APP_SECRET_JSON"]) if os.getenv("APP_SECRET_JSON") else None
+
+        if value is None:
+            source = "disk"
+            value = _read_cache_file(secret_name)
+
+        if value is None:
+            source = "secretsmanager"
+            value = json.loads(
+                get_client("secretsmanager").get_secret_value(
+                    SecretId=secret_name
+                )["SecretString"]
+            )
+            _write_cache_file(secret_name, value)
+
+        _secrets[secret_name] = value
+
+        _record("secrets", secret_name, {
+            "source": source,
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        })
+
+        return value
+
+
+# ============================================================
+# LAZY CLIENTS
+# ============================================================
+
+class LazyClient:
+    """
+    Stands in for a client built on first attribute access, so modules
+    can keep `bedrock = ...` globals without paying for them at import.
+    """
+
+    def __init__(self, name: str, factory):
+
+        self._name = name
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+
+        if self._client is None:
+
+            with self._lock:
+
+                if self._client is None:
+
+                    start = time.perf_counter()
+
+                    self._client = self._factory()
+
+                    _record("clients", self._name, round((time.perf_counter() - start) * 1000, 2))
+
+        return self._client
+
+    def __getattr__(self, attr):
+
+        return getattr(self._get(), attr)
+
+
+_clients = {}
+
+
+def get_client(service: str, region: str = REGION):
+    """
+    Shared default-config boto3 client per (service, region).
+    """
+
+    key = (service, region)
+
+    if key not in _clients:
+        # setdefault: concurrent first callers end up sharing one client
+        _clients.setdefault(
+            key, LazyClient(f"{service}@{region}", lambda: boto3.client(service, region_name=region))
+        )
+
+    return _clients[key]
+
+
+# ============================================================
+# STARTUP REPORT
+# ============================================================
+
+def startup_report() -> dict:
+    """
+    Secrets fetched (source + ms), clients built (ms) and time since
+    this module was first imported.
+    """
+
+    with _startup_lock:
+        return {
+            "since_start_ms": round((time.perf_counter() - PROCESS_START) * 1000, 2),
+            "secrets": dict(_startup["secrets"]),
+            "clients": dict(_startup["clients"]),
+        }
@@ -0,0 +1,189 @@
+# context_packer.py
+
+import math
+import os
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Rough chars-per-token for English prose with Claude tokenizers
+CHARS_PER_TOKEN = 4
+
+# Ingest chunker overlap (aws/vector_processor_lambda.chunk_text)
+CHUNK_OVERLAP = 200
+
+
+def estimate_tokens(text: str) -> int:
+
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+# ============================================================
+# CHUNK ORDER
+# ============================================================
+
+def chunk_index(hit: dict):
+    """
+    Position of a chunk inside its document, from its key
+    ("doc:<document_id>:<i>"). None if the key has no index.
+    """
+
+    key = hit.get("key") or ""
+
+    try:
+        return int(key.rsplit(":", 1)[-1])
+    except ValueError:
+        return None
+
+
+# ============================================================
+# OVERLAP REMOVAL
+# ============================================================
+
+def overlap_length(left: str, right: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """
+    Length of the longest suffix of left that is a prefix of right,
+    up to max_overlap characters.
+    """
+
+    limit = min(len(left), len(right), max_overlap)
+
+    # Fast path: the chunker's exact overlap
+    if limit == max_overlap and left[-limit:] == right[:limit]:
+        return limit
+
+    for k in range(limit, 0, -1):
+        if left.endswith(right[:k]):
+            return k
+
+    return 0
+
+
+def merge_adjacent(hits):
+    """
+    Merge consecutive chunks of one document into segments, dropping
+    the overlap each chunk repeats from the previous one.
+    hits: chunks of a single document.
+    Returns [{"text", "score", "chunks", "overlap_removed"}] in
+    document order.
+    """
+
+    ordered = sorted(
+        hits,
+        key=lambda h: (chunk_index(h) is None, chunk_index(h) or 0)
+    )
+
+    segments = []
+    last_index = None
+
+    for h in ordered:
+
+        text = h.get("text") or ""
+        index = chunk_index(h)
+
+        if (
+            segments
+            and index is not None
+            and last_index is not None
+            and index == last_index + 1
+        ):
+
+            seg = segments[-1]
+            cut = overlap_length(seg["text"], text)
+
+            seg["text"] += text[cut:]
+            seg["score"] = max(seg["score"], h.get("score", 0))
+            seg["chunks"] += 1
+            seg["overlap_removed"] += cut
+
+        elif index is not None and index == last_index:
+
+            # Same chunk returned twice (e.g. vector + keyword hit)
+            continue
+
+        else:
+
+            segments.append({
+                "text": text,
+                "score": h.get("score", 0),
+                "chunks": 1,
+                "overlap_removed": 0,
+            })
+
+        last_index = index
+
+    return segments
+
+
+# ============================================================
+# PACKER
+# ============================================================
+
+def pack_context(top_docs, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Build the prompt context from ranked documents.
+
+    - Adjacent chunks of the same document are merged, overlap removed
+    - Segments are admitted in score order until the token budget is
+      spent (segments that don't fit are skipped, smaller ones may
+      still go in)
+    - Admitted segments are emitted in document rank / chunk order
+
+    Returns (context, stats).
+    """
+
+    candidates = []
+    tokens_before = 0
+    overlap_removed = 0
+
+    for doc_rank, (fname, data) in enumerate(top_docs):
+
+        by_document = {}
+
+        for h in data.get("hits", []):
+
+            tokens_before += estimate_tokens(h.get("text") or "")
+
+            by_document.setdefault(h.get("document_id"), []).append(h)
+
+        for hits in by_document.values():
+
+            for position, seg in enumerate(merge_adjacent(hits)):
+
+                overlap_removed += seg["overlap_removed"]
+
+                seg["tokens"] = estimate_tokens(seg["text"])
+                seg["order"] = (doc_rank, position)
+
+                candidates.append(seg)
+
+    admitted = []
+    used = 0
+
+    for seg in sorted(candidates, key=lambda s: s["score"], reverse=True):
+
+        if used + seg["tokens"] > token_budget:
+            continue
+
+        admitted.append(seg)
+        used += seg["tokens"]
+
+    admitted.sort(key=lambda s: s["order"])
+
+    context = "".join(seg["text"] + "\n" for seg in admitted)
+
+    stats = {
+        "token_budget": token_budget,
+        "tokens_before": tokens_before,
+        "tokens_after": used,
+        "tokens_saved": max(0, tokens_before - used),
+        "overlap_chars_removed": overlap_removed,
+        "segments": len(admitted),
+        "segments_dropped": len(candidates) - len(admitted),
+    }
+
+    return context, stats
@@ -1,72 +1,208 @@
 from langcache import LangCache
-import json
-import boto3
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 
-# Configuration
-REGION = "eu-west-1"
-secretsmanager = boto3.client("secretsmanager", region_name=REGION)
+from cache_utils import TTLLRUCache
+from config import get_secret
+from metrics import observe_stage
 
-# Secrets
-def get_secrets(secret_name):
-    return json.loads(
-        secretsmanager.get_secret_value(SecretId=secret_name)["SecretString"]
-    )
 
-secret = get_secrets("dev/python/api")
+LANGCACHE_ENABLED = True
+
+# Server URL, cache id and API key come from the shared secret on first use
 
+LANGCACHE_TIMEOUT_MS = int(os.getenv("LANGCACHE_TIMEOUT_MS", "400"))
+LANGCACHE_MAX_CONNECTIONS = int(os.getenv("LANGCACHE_MAX_CONNECTIONS", "20"))
+LANGCACHE_STORE_WORKERS = int(os.getenv("LANGCACHE_STORE_WORKERS", "2"))
+# Keys carry a context fingerprint, so entries can live long
+LANGCACHE_TTL_SECONDS = int(os.getenv("LANGCACHE_TTL_SECONDS", str(30 * 24 * 3600)))
 
-LANGCACHE_ENABLED = True
+# Process-wide client: one warm, pooled HTTP connection set for all requests
+_langcache_client = None
+_langcache_client_lock = threading.Lock()
+
+# Background writer so stores never sit on the response path
+_store_executor = ThreadPoolExecutor(
+    max_workers=LANGCACHE_STORE_WORKERS,
+    thread_name_prefix="langcache-store"
+)
 
-LANGCACHE_API_KEY = secret["LANGCACHE_API_KEY"]
-LANGCACHE_SERVER_URL = secret["LANGCACHE_SERVER_URL"]
-LANGCACHE_CACHE_ID = secret["LANGCACHE_CACHE_ID"]
 
 def get_langcache_client():
+    global _langcache_client
+
     if not LANGCACHE_ENABLED:
         return None
 
-    return LangCache(
-        server_url=LANGCACHE_SERVER_URL,
-        cache_id=LANGCACHE_CACHE_ID,
-        api_key=LANGCACHE_API_KEY
-    )
-
-def langcache_lookup(prompt: str):
+    if _langcache_client is None:
+        with _langcache_client_lock:
+            if _langcache_client is None:
+                secret = get_secret()
+                _langcache_client = LangCache(
+                    server_url=secret["LANGCACHE_SERVER_URL"],
+                    cache_id=secret["LANGCACHE_CACHE_ID"],
+                    api_key=secret["LANGCACHE_API_KEY"],
+                    client=httpx.Client(
+                        follow_redirects=True,
+                        limits=httpx.Limits(
+                            max_connections=LANGCACHE_MAX_CONNECTIONS,
+                            max_keepalive_connections=LANGCACHE_MAX_CONNECTIONS
+                        )
+                    ),
+                    timeout_ms=LANGCACHE_TIMEOUT_MS
+                )
+
+    return _langcache_client
+
+def langcache_lookup(prompt: str, attributes: dict = None):
     if not LANGCACHE_ENABLED:
         print("🚫 LANGCACHE DISABLED")
         return None
 
-    with get_langcache_client() as lc:
-        print("🔍 LANGCACHE SEARCH")
+    lc = get_langcache_client()
+    print("🔍 LANGCACHE SEARCH")
+
+    try:
+        if attributes:
+            search_response = lc.search(prompt=prompt, attributes=attributes)
+        else:
+            search_response = lc.search(prompt=prompt)
+    except Exception as e:
+        # Slow or failing cache is treated as a miss
+        print(f"❄️ LANGCACHE MISS (lookup failed: {type(e).__name__}: {e})")
+        return None
 
-        search_response = lc.search(prompt=prompt)
-        print(search_response)
-        # Defensive checks
-        if not search_response:
-            print("❄️ LANGCACHE MISS (no response object)")
-            return None
+    print(search_response)
+    # Defensive checks
+    if not search_response:
+        print("❄️ LANGCACHE MISS (no response object)")
+        return None
 
-        entries = getattr(search_response, "data", None)
+    entries = getattr(search_response, "data", None)
 
-        if not entries:
-            print("❄️ LANGCACHE MISS (no entries)")
-            return None
+    if not entries:
+        print("❄️ LANGCACHE MISS (no entries)")
+        return None
 
-        # Pick best match (LangCache already sorts by similarity)
-        best_entry = entries[0]
+    # Pick best match (LangCache already sorts by similarity)
+    best_entry = entries[0]
 
-        print(
-            f"⚡ LANGCACHE HIT → "
-            f"similarity={best_entry.similarity}, "
-            f"id={best_entry.id}"
-        )
+    print(
+        f"⚡ LANGCACHE HIT → "
+        f"similarity={best_entry.similarity}, "
+        f"id={best_entry.id}"
+    )
 
-        return best_entry.response
+    return best_entry.response
 
-def langcache_store(prompt: str, response: str):
+def _langcache_store_sync(prompt: str, response: str, attributes: dict = None):
+    try:
+        get_langcache_client().set(
+            prompt=prompt,
+            response=response,
+            attributes=attributes,
+            ttl_millis=LANGCACHE_TTL_SECONDS * 1000
+        )
+        print("🧊 STORED RESPONSE IN LANGCACHE")
+    except Exception as e:
+        print(f"⚠️ LANGCACHE STORE FAILED: {type(e).__name__}: {e}")
+
+def langcache_store(prompt: str, response: str, wait: bool = False, attributes: dict = None):
+    """
+    Store in the background by default; wait=True blocks until done.
+    """
     if not LANGCACHE_ENABLED:
         return
 
-    with get_langcache_client() as lc:
-        lc.set(prompt=prompt, response=response)
-        print("🧊 STORED RESPONSE IN LANGCACHE")
\ No newline at end of file
+    future = _store_executor.submit(_langcache_store_sync, prompt, response, attributes)
+
+    if wait:
+        future.result()
+
+
+# ============================================================
+# LOCAL ANSWER CACHE (IN FRONT OF LANGCACHE)
+# ============================================================
+
+LOCAL_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_ANSWER_CACHE_MAX_ENTRIES", "512"))
+LOCAL_ANSWER_CACHE_MAX_BYTES = int(os.getenv("LOCAL_ANSWER_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+LOCAL_ANSWER_CACHE_TTL_SECONDS = int(os.getenv("LOCAL_ANSWER_CACHE_TTL_SECONDS", "900"))
+
+local_answer_cache = TTLLRUCache(
+    max_entries=LOCAL_ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=LOCAL_ANSWER_CACHE_TTL_SECONDS,
+    max_bytes=LOCAL_ANSWER_CACHE_MAX_BYTES
+)
+
+_answer_stats_lock = threading.Lock()
+_answer_stats = {
+    "lookups": 0,
+    "local_hits": 0,
+    "langcache_hits": 0,
+    "misses": 0,
+    "langcache_lookup_ms": 0.0,
+    "saved_ms": 0.0,
+}
+
+
+def answer_cache_lookup(key: str, attributes: dict = None):
+    """
+    Local TTL+LRU first, then LangCache. LangCache hits are copied
+    into the local tier. attributes scope the LangCache search exactly
+    (semantic matching alone would ignore a fingerprint in the key).
+    """
+    cached = local_answer_cache.get(key)
+
+    if cached is not None:
+        with _answer_stats_lock:
+            _answer_stats["lookups"] += 1
+            _answer_stats["local_hits"] += 1
+            remote = _answer_stats["langcache_hits"] + _answer_stats["misses"]
+            if remote:
+                # Credit the average remote lookup we just avoided
+                _answer_stats["saved_ms"] += _answer_stats["langcache_lookup_ms"] / remote
+        print("⚡ LOCAL ANSWER CACHE HIT")
+        return cached
+
+    start = time.perf_counter()
+    response = langcache_lookup(key, attributes=attributes)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    observe_stage("langcache_lookup", elapsed_ms / 1000)
+
+    with _answer_stats_lock:
+        _answer_stats["lookups"] += 1
+        _answer_stats["langcache_lookup_ms"] += elapsed_ms
+        _answer_stats["langcache_hits" if response else "misses"] += 1
+
+    if response:
+        local_answer_cache.set(key, response)
+
+    return response
+
+
+def answer_cache_store(key: str, answer: str, attributes: dict = None):
+    local_answer_cache.set(key, answer)
+    langcache_store(key, answer, attributes=attributes)
+
+
+def get_answer_cache_stats():
+    with _answer_stats_lock:
+        s = dict(_answer_stats)
+
+    remote = s["langcache_hits"] + s["misses"]
+
+    return {
+        "lookups": s["lookups"],
+        "local_hits": s["local_hits"],
+        "langcache_hits": s["langcache_hits"],
+        "misses": s["misses"],
+        "local_hit_rate": round(s["local_hits"] / s["lookups"], 3) if s["lookups"] else 0.0,
+        "avg_langcache_lookup_ms": round(s["langcache_lookup_ms"] / remote, 2) if remote else 0.0,
+        "saved_ms_total": round(s["saved_ms"], 2),
+        "local_entries": len(local_answer_cache),
+        "local_bytes": local_answer_cache.size_bytes,
+    }
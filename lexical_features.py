@@ -0,0 +1,141 @@
+# lexical_features.py
+
+import json
+import math
+import re
+
+import numpy as np
+
+
+# ============================================================
+# TOKENIZATION
+# ============================================================
+
+def tokenize(text: str):
+
+    text = text.lower()
+
+    text = re.sub(r"[^a-z0-9]", " ", text)
+
+    return [t for t in text.split() if len(t) > 1]
+
+
+# ============================================================
+# INGEST-TIME FEATURES
+# ============================================================
+# Keep in sync with chunk_features() in aws/vector_processor_lambda.py
+
+def chunk_features(text: str) -> dict:
+    """
+    Lexical features stored next to each chunk at ingest so query-time
+    scoring never re-tokenizes chunk text.
+    """
+
+    counts = {}
+
+    for t in tokenize(text):
+        counts[t] = counts.get(t, 0) + 1
+
+    return {
+        "token_counts": json.dumps(counts, separators=(",", ":")),
+        "token_count": sum(counts.values()),
+        "numeric_count": len(re.findall(r"\d+", text)),
+    }
+
+
+def hit_features(hit: dict):
+    """
+    (token_counts, token_count, numeric_count) for a search hit.
+    Chunks ingested before features existed are computed on the fly.
+    """
+
+    raw = hit.get("token_counts")
+
+    if raw:
+
+        if isinstance(raw, bytes):
+            raw = raw.decode()
+
+        return (
+            json.loads(raw),
+            int(hit.get("token_count") or 0),
+            int(hit.get("numeric_count") or 0),
+        )
+
+    features = chunk_features(hit.get("text") or "")
+
+    return (
+        json.loads(features["token_counts"]),
+        features["token_count"],
+        features["numeric_count"],
+    )
+
+
+# ============================================================
+# CHUNK SCORING
+# ============================================================
+
+def score_chunk(query, chunk):
+    """
+    Reference per-chunk scorer. score_chunks() computes the same value
+    for a whole candidate set from precomputed features.
+    """
+
+    q_tokens = tokenize(query)
+
+    c_tokens = tokenize(chunk)
+
+    if not q_tokens or not c_tokens:
+        return 0
+
+    overlap = len(set(q_tokens) & set(c_tokens)) / len(q_tokens)
+
+    density = sum(t in q_tokens for t in c_tokens) / len(c_tokens)
+
+    numeric = len(re.findall(r"\d+", chunk)) / len(c_tokens)
+
+    length_penalty = math.log(len(c_tokens) + 1)
+
+    return (overlap * 3 + density * 8 + numeric * 5) / length_penalty
+
+
+def score_chunks(query, hits):
+    """
+    Vectorized score_chunk over all hits.
+    Builds a (hits x unique query tokens) count matrix once and scores
+    every candidate with array arithmetic.
+    """
+
+    q_tokens = tokenize(query)
+
+    if not q_tokens or not hits:
+        return np.zeros(len(hits))
+
+    vocab = list(dict.fromkeys(q_tokens))
+
+    features = [hit_features(h) for h in hits]
+
+    counts = np.array(
+        [[c.get(t, 0) for t in vocab] for c, _, _ in features],
+        dtype=np.float64
+    )
+
+    n_tokens = np.array([n for _, n, _ in features], dtype=np.float64)
+
+    n_numeric = np.array([n for _, _, n in features], dtype=np.float64)
+
+    valid = n_tokens > 0
+
+    safe_n = np.where(valid, n_tokens, 1.0)
+
+    overlap = (counts > 0).sum(axis=1) / len(q_tokens)
+
+    density = counts.sum(axis=1) / safe_n
+
+    numeric = n_numeric / safe_n
+
+    length_penalty = np.where(valid, np.log(n_tokens + 1), 1.0)
+
+    scores = (overlap * 3 + density * 8 + numeric * 5) / length_penalty
+
+    return np.where(valid, scores, 0.0)
@@ -1,68 +1,216 @@
+import asyncio
 import json
 import os
 import boto3
+from botocore.config import Config
 from botocore.exceptions import NoRegionError
 
+from bedrock_invoke import ainvoke_with_resilience, invoke_with_resilience
+from config import LazyClient
+
 # Respect AWS_REGION environment variable; default to eu-west-1 if not set
 AWS_REGION = os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "eu-west-1"
 
-try:
-    bedrock = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-except NoRegionError:
-    raise RuntimeError("AWS region not configured. Set AWS_REGION environment variable.")
+# Connection pool / timeout / deadline settings (sync + async clients).
+# Retries happen in bedrock_invoke (breaker + jitter + deadline), not in
+# botocore.
+LLM_MAX_POOL_CONNECTIONS = int(os.getenv("LLM_MAX_POOL_CONNECTIONS", "50"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "60"))
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "30"))
+
+def _client_config_kwargs():
+    return {
+        "max_pool_connections": LLM_MAX_POOL_CONNECTIONS,
+        # Single attempt; adaptive mode keeps botocore's client-side rate limiter
+        "retries": {"mode": "adaptive", "total_max_attempts": 1},
+        "connect_timeout": LLM_CONNECT_TIMEOUT_SECONDS,
+        # Never wait on a socket longer than the whole call may take
+        "read_timeout": min(LLM_READ_TIMEOUT_SECONDS, LLM_CALL_DEADLINE_SECONDS),
+    }
+
+def _create_bedrock():
+    try:
+        return boto3.client(
+            "bedrock-runtime",
+            region_name=AWS_REGION,
+            config=Config(**_client_config_kwargs())
+        )
+    except NoRegionError:
+        raise RuntimeError("AWS region not configured. Set AWS_REGION environment variable.")
+
+# Built on first call, not at import
+bedrock = LazyClient("bedrock-runtime@" + AWS_REGION, _create_bedrock)
 
 MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
 
-def call_claude_with_tools(messages, tools):
-    """
-    Calls Claude with tool calling support.
-    """
-    body = {
+def _tools_body(messages, tools):
+    return {
         "anthropic_version": "bedrock-2023-05-31",
         "messages": messages,
         "max_tokens": 1000,
         "temperature": 0.0,
         "tools": tools
     }
+
+def _invoke(body):
+    """
+    One invoke_model round trip (body read included) through the
+    shared circuit breaker / retry / deadline wrapper.
+    """
+    payload = json.dumps(body)
+
+    def call():
+        response = bedrock.invoke_model(
+            modelId=MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=payload
+        )
+        return json.loads(response["body"].read())
+
+    return invoke_with_resilience(MODEL_ID, call, deadline_seconds=LLM_CALL_DEADLINE_SECONDS)
+
+def call_claude_with_tools(messages, tools):
+    """
+    Calls Claude with tool calling support.
+    """
+    body = _tools_body(messages, tools)
     
-    response = bedrock.invoke_model(
-        modelId=MODEL_ID,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(body)
-    )
-    
-    raw_output = response["body"].read()
-    parsed = json.loads(raw_output)
-    
-    return parsed
+    return _invoke(body)
 
 def call_claude_simple(prompt):
     """
     Simple call for summarization.
     """
+    body = _simple_body(prompt)
+    
+    parsed = _invoke(body)
+    
+    text = parsed["content"][0]["text"]
+    return text
+
+def _simple_body(prompt):
     wrapped_prompt = f"""
 {prompt}
 
 Respond with a well-formatted summary.
 """
-    
-    body = {
+
+    return {
         "anthropic_version": "bedrock-2023-05-31",
         "messages": [{"role": "user", "content": wrapped_prompt}],
         "max_tokens": 1000,
         "temperature": 0.0
     }
-    
-    response = bedrock.invoke_model(
-        modelId=MODEL_ID,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(body)
+
+def stream_claude_simple(prompt):
+    """
+    Streaming variant of call_claude_simple.
+    Yields answer text deltas as Bedrock produces them.
+    """
+    # Only opening the stream is retried; a stream that fails midway
+    # can't be replayed without duplicating tokens
+    response = invoke_with_resilience(
+        MODEL_ID,
+        lambda: bedrock.invoke_model_with_response_stream(
+            modelId=MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps(_simple_body(prompt))
+        ),
+        deadline_seconds=LLM_CALL_DEADLINE_SECONDS
     )
-    
-    raw_output = response["body"].read()
-    parsed = json.loads(raw_output)
-    
-    text = parsed["content"][0]["text"]
-    return text
\ No newline at end of file
+
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+
+        payload = json.loads(chunk["bytes"])
+
+        if payload.get("type") == "content_block_delta":
+            delta = payload.get("delta", {})
+            if delta.get("type") == "text_delta" and delta.get("text"):
+                yield delta["text"]
+
+
+# ============================================================
+# ASYNC CLIENT (aiobotocore)
+# ============================================================
+# One long-lived client per process, created on first use inside the
+# running event loop. Calls await socket I/O instead of holding a
+# thread, so concurrency is bounded by LLM_MAX_POOL_CONNECTIONS.
+
+_async_bedrock = None
+_async_bedrock_ctx = None
+_async_bedrock_lock = None
+
+async def get_async_bedrock():
+    global _async_bedrock, _async_bedrock_ctx, _async_bedrock_lock
+
+    if _async_bedrock is not None:
+        return _async_bedrock
+
+    if _async_bedrock_lock is None:
+        _async_bedrock_lock = asyncio.Lock()
+
+    async with _async_bedrock_lock:
+        if _async_bedrock is None:
+            # Imported lazily so sync-only callers (Lambda, scripts) don't need aiobotocore
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+
+            ctx = get_session().create_client(
+                "bedrock-runtime",
+                region_name=AWS_REGION,
+                config=AioConfig(**_client_config_kwargs())
+            )
+            _async_bedrock = await ctx.__aenter__()
+            _async_bedrock_ctx = ctx
+
+    return _async_bedrock
+
+async def aclose_bedrock():
+    """
+    Close the async client (call from the app shutdown hook).
+    """
+    global _async_bedrock, _async_bedrock_ctx
+
+    if _async_bedrock_ctx is not None:
+        await _async_bedrock_ctx.__aexit__(None, None, None)
+
+    _async_bedrock = None
+    _async_bedrock_ctx = None
+
+async def _ainvoke(body):
+    """
+    Async _invoke: same breaker / retry / deadline policy and stats.
+    """
+    payload = json.dumps(body)
+    client = await get_async_bedrock()
+
+    async def call():
+        response = await client.invoke_model(
+            modelId=MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=payload
+        )
+        async with response["body"] as stream:
+            return json.loads(await stream.read())
+
+    return await ainvoke_with_resilience(MODEL_ID, call, deadline_seconds=LLM_CALL_DEADLINE_SECONDS)
+
+async def acall_claude_with_tools(messages, tools):
+    """
+    Async call_claude_with_tools.
+    """
+    return await _ainvoke(_tools_body(messages, tools))
+
+async def acall_claude_simple(prompt):
+    """
+    Async call_claude_simple.
+    """
+    parsed = await _ainvoke(_simple_body(prompt))
+    return parsed["content"][0]["text"]
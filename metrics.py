@@ -0,0 +1,153 @@
+# metrics.py
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+# Seconds; covers cache hits (ms) through slow LLM calls (tens of s)
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+STAGE_METRIC = "agent_stage_duration_seconds"
+
+STAGES = (
+    "planner_llm",
+    "query_embedding",
+    "redis_knn",
+    "keyword_fallback",
+    "chunk_scoring",
+    "langcache_lookup",
+    "answer_llm",
+    "dynamodb_scan",
+    "presign",
+)
+
+
+# ============================================================
+# HISTOGRAM
+# ============================================================
+
+class Histogram:
+    """
+    Cumulative-bucket latency histogram, one series per label value.
+    observe() is a bisect plus a few adds under a lock.
+    """
+
+    def __init__(self, name: str, help_text: str, label: str, buckets=DEFAULT_BUCKETS, label_values=()):
+
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+        # Known series are exported (at zero) before their first sample
+        for value in label_values:
+            self._series[value] = self._new_series()
+
+    def _new_series(self):
+
+        # Per-bucket counts (+Inf last), sum, count
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, label_value: str, seconds: float):
+
+        index = bisect_left(self.buckets, seconds)
+
+        with self._lock:
+
+            series = self._series.get(label_value)
+
+            if series is None:
+                series = self._series[label_value] = self._new_series()
+
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    @contextmanager
+    def time(self, label_value: str):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - start)
+
+    def render(self) -> list:
+        """
+        Prometheus text exposition lines for this histogram.
+        """
+
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        for value in sorted(snapshot):
+
+            counts, total, count = snapshot[value]
+            cumulative = 0
+
+            for upper, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{upper}"}} {cumulative}')
+
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {count}')
+
+        return lines
+
+
+# ============================================================
+# REGISTRY
+# ============================================================
+
+stage_latency = Histogram(
+    STAGE_METRIC,
+    "Latency of agent pipeline stages in seconds.",
+    "stage",
+    label_values=STAGES,
+)
+
+_registry = [stage_latency]
+
+
+def observe_stage(stage: str, seconds: float):
+
+    stage_latency.observe(stage, seconds)
+
+
+def time_stage(stage: str):
+    """
+    with time_stage("redis_knn"): ...
+    """
+
+    return stage_latency.time(stage)
+
+
+def render_metrics() -> str:
+    """
+    All registered metrics in Prometheus text format (0.0.4).
+    """
+
+    lines = []
+
+    for metric in _registry:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
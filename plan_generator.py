@@ -1,12 +1,16 @@
 # plan_generator.py
 
-from typing import List
+from typing import List, Tuple
+import os
 import re
+import threading
 
 
 from langsmith import traceable
 
 from llm import call_claude_simple
+from metrics import time_stage
+from cache_utils import TTLLRUCache, normalize_text
 
 
 PLAN_PROMPT = """
@@ -58,15 +62,66 @@ User question:
 
 
 # ------------------------------------------------------------
-# 🔵 HARDENED STEP EXTRACTOR
+# 🔵 INTENT PHRASES
 # ------------------------------------------------------------
-def _extract_steps(text: str, question: str) -> List[str]:
-    text = text.lower()
+discovery_phrases = [
+    "show me all available documents",
+    "show me all documents",
+    "list all documents",
+    "what documents do i have",
+    "what all documents do you have",
+    "available documents",
+    "what files are available",
+    "document list",
+    "list of documents",
+    "doc list",
+    "list doc"
+    "doc metadata",
+    "metadata list"
+]
+
+content_phrases = [
+    "marks",
+    "score",
+    "sgpa",
+    "transaction",
+    "details",
+    "latest",
+    "extract",
+    "from documents",
+    "from my documents",
+    "insurance",
+    "less than",
+    "min","minimum","max","maximum","all the details"
+]
+
+download_phrases = [
+    "download",
+    "file",
+    "send me",
+    "also the file",
+    "give me the file",
+    "copy of",
+    "pdf",
+    "save",
+    "future use",
+    "link"
+]
+
+
+def _classify(question: str):
     question_l = question.lower()
 
-    # --------------------------------------------------
-    # 1️⃣ Extract LLM-proposed steps (fuzzy)
-    # --------------------------------------------------
+    is_discovery = any(p in question_l for p in discovery_phrases)
+    is_content = any(p in question_l for p in content_phrases)
+    is_download = any(p in question_l for p in download_phrases)
+
+    return is_discovery, is_content, is_download
+
+
+def _llm_steps(text: str) -> List[str]:
+    text = text.lower()
+
     llm_steps = []
     if "search_documents" in text:
         llm_steps.append("search_documents")
@@ -75,58 +130,23 @@ def _extract_steps(text: str, question: str) -> List[str]:
     if "list_documents" in text:
         llm_steps.append("list_documents")
 
-    llm_steps = list(dict.fromkeys(llm_steps))  # dedupe, preserve order
+    return list(dict.fromkeys(llm_steps))  # dedupe, preserve order
+
+
+# ------------------------------------------------------------
+# 🔵 HARDENED STEP EXTRACTOR
+# ------------------------------------------------------------
+def _extract_steps(text: str, question: str) -> List[str]:
 
     # --------------------------------------------------
-    # 2️⃣ Intent classification (STRICT)
+    # 1️⃣ Extract LLM-proposed steps (fuzzy)
     # --------------------------------------------------
-    discovery_phrases = [
-        "show me all available documents",
-        "show me all documents",
-        "list all documents",
-        "what documents do i have",
-        "what all documents do you have",
-        "available documents",
-        "what files are available",
-        "document list",
-        "list of documents",
-        "doc list",
-        "list doc"
-        "doc metadata",
-        "metadata list"
-    ]
-
-    content_phrases = [
-        "marks",
-        "score",
-        "sgpa",
-        "transaction",
-        "details",
-        "latest",
-        "extract",
-        "from documents",
-        "from my documents",
-        "insurance",
-        "less than",
-        "min","minimum","max","maximum","all the details"
-    ]
-
-    download_phrases = [
-        "download",
-        "file",
-        "send me",
-        "also the file",
-        "give me the file",
-        "copy of",
-        "pdf",
-        "save",
-        "future use",
-        "link"
-    ]
+    llm_steps = _llm_steps(text)
 
-    is_discovery = any(p in question_l for p in discovery_phrases)
-    is_content = any(p in question_l for p in content_phrases)
-    is_download = any(p in question_l for p in download_phrases)
+    # --------------------------------------------------
+    # 2️⃣ Intent classification (STRICT)
+    # --------------------------------------------------
+    is_discovery, is_content, is_download = _classify(question)
 
     # --------------------------------------------------
     # 🔴 RULE 1: PURE DISCOVERY WINS (ABSOLUTE)
@@ -167,6 +187,59 @@ def _extract_steps(text: str, question: str) -> List[str]:
     return steps
 
 
+# ------------------------------------------------------------
+# 🔵 RULE ENGINE (NO LLM)
+# ------------------------------------------------------------
+def rule_plan(question: str) -> Tuple[List[str], float]:
+    """
+    Deterministic plan plus a confidence in [0, 1].
+    The LLM output only changes _extract_steps' result when no intent
+    phrase matched (RULE 2), so any phrase match is final.
+    """
+    is_discovery, is_content, is_download = _classify(question)
+
+    if is_discovery or is_content or is_download:
+        return _extract_steps("", question), 1.0
+
+    return ["search_documents"], 0.3
+
+
+# ------------------------------------------------------------
+# 🔵 PLAN CACHE + COUNTERS
+# ------------------------------------------------------------
+PLANNER_CONFIDENCE_THRESHOLD = float(os.getenv("PLANNER_CONFIDENCE_THRESHOLD", "0.5"))
+
+plan_cache = TTLLRUCache(
+    max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=int(os.getenv("PLAN_CACHE_TTL_SECONDS", "86400"))
+)
+
+_planner_stats_lock = threading.Lock()
+_planner_stats = {
+    "plans": 0,
+    "cache_hits": 0,
+    "llm_skipped": 0,
+    "llm_called": 0,
+    "llm_disagreed": 0,
+}
+
+
+def _count(name: str):
+    with _planner_stats_lock:
+        _planner_stats[name] += 1
+
+
+def get_planner_stats():
+    with _planner_stats_lock:
+        s = dict(_planner_stats)
+
+    decided = s["llm_skipped"] + s["llm_called"]
+    s["llm_skip_rate"] = round(s["llm_skipped"] / decided, 3) if decided else 0.0
+    s["llm_disagree_rate"] = round(s["llm_disagreed"] / s["llm_called"], 3) if s["llm_called"] else 0.0
+
+    return s
+
+
 # ------------------------------------------------------------
 # 🔵 PUBLIC API (PLANNER)
 # ------------------------------------------------------------
@@ -179,20 +252,59 @@ def _extract_steps(text: str, question: str) -> List[str]:
 def generate_plan(question: str) -> List[str]:
     """
     Planner:
-    - LLM decides WHAT steps to run
-    - Output is normalized deterministically
+    - Rule engine first; confident plans skip the LLM
+    - Ambiguous questions: LLM decides, output normalized deterministically
+    - Plans are cached per normalized question
     """
 
-    response = call_claude_simple(
-        PLAN_PROMPT.format(question=question)
-    )
+    _count("plans")
 
-    print("RAW PLANNER OUTPUT:")
-    print(response)
+    cache_key = normalize_text(question)
 
-    steps = _extract_steps(response, question)
+    cached = plan_cache.get(cache_key)
+
+    if cached is not None:
+        _count("cache_hits")
+        print(f"PLAN CACHE HIT → {cached}")
+        return list(cached)
+
+    rule_steps, confidence = rule_plan(question)
+
+    if confidence >= PLANNER_CONFIDENCE_THRESHOLD:
+
+        _count("llm_skipped")
+
+        steps = rule_steps
+
+        print(f"RULE PLAN (confidence={confidence}, LLM skipped) → {steps}")
+
+    else:
+
+        _count("llm_called")
+
+        with time_stage("planner_llm"):
+            response = call_claude_simple(
+                PLAN_PROMPT.format(question=question)
+            )
+
+        print("RAW PLANNER OUTPUT:")
+        print(response)
+
+        steps = _extract_steps(response, question)
+
+        if steps != rule_steps:
+            _count("llm_disagreed")
+
+        print(
+            f"LLM PLAN (rule confidence={confidence}) → {steps} "
+            f"| rules → {rule_steps}"
+        )
 
     if not steps:
         steps = ["search_documents"]
 
-    return steps
\ No newline at end of file
+    plan_cache.set(cache_key, list(steps))
+
+    print(f"PLANNER STATS → {get_planner_stats()}")
+
+    return steps
@@ -0,0 +1,79 @@
+# score_chunk_benchmark.py
+#
+# Offline microbenchmark: per-chunk score_chunk (re-tokenizes every
+# chunk) vs vectorized score_chunks over ingest-time features.
+#
+#   python score_chunk_benchmark.py
+
+import random
+import time
+
+from lexical_features import chunk_features, score_chunk, score_chunks
+
+
+WORDS = [
+    "sgpa", "semester", "roll", "marks", "hsbc", "transaction", "balance",
+    "insurance", "policy", "vehicle", "premium", "credit", "debit", "date",
+    "amount", "statement", "university", "grade", "result", "account",
+]
+
+QUERY = "Give me SGPA and roll no of semester 2 from the HSBC statement"
+
+REPEATS = 20
+
+
+def make_chunk(size=1000):
+
+    parts = []
+
+    while sum(len(p) + 1 for p in parts) < size:
+
+        if random.random() < 0.15:
+            parts.append(str(random.randint(1, 99999)))
+        else:
+            parts.append(random.choice(WORDS))
+
+    return " ".join(parts)[:size]
+
+
+def bench(top_k):
+
+    hits = []
+
+    for _ in range(top_k):
+
+        text = make_chunk()
+
+        hits.append({"text": text, **chunk_features(text)})
+
+    start = time.perf_counter()
+
+    for _ in range(REPEATS):
+        baseline = [score_chunk(QUERY, h["text"]) for h in hits]
+
+    baseline_ms = (time.perf_counter() - start) * 1000 / REPEATS
+
+    start = time.perf_counter()
+
+    for _ in range(REPEATS):
+        vectorized = score_chunks(QUERY, hits)
+
+    vectorized_ms = (time.perf_counter() - start) * 1000 / REPEATS
+
+    max_diff = max(abs(a - b) for a, b in zip(baseline, vectorized))
+
+    print(
+        f"top_k={top_k:<4} "
+        f"score_chunk={baseline_ms:8.3f} ms  "
+        f"score_chunks={vectorized_ms:8.3f} ms  "
+        f"speedup={baseline_ms / vectorized_ms:5.1f}x  "
+        f"max_diff={max_diff:.2e}"
+    )
+
+
+if __name__ == "__main__":
+
+    random.seed(7)
+
+    for k in (20, 100, 500):
+        bench(k)
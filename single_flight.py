@@ -0,0 +1,96 @@
+# single_flight.py
+
+import threading
+from concurrent.futures import Future
+
+
+# ============================================================
+# SINGLE-FLIGHT
+# ============================================================
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller
+    (leader) starts the work, callers arriving while it is in flight
+    share its result (or exception). Nothing is cached afterwards.
+    """
+
+    def __init__(self):
+
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    def _forget(self, key, future):
+
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def join_or_start(self, key, start, join=None):
+        """
+        Return (future, is_leader). start() is called only by the
+        leader and must return a concurrent.futures.Future; if it
+        raises, nothing is registered and the error propagates.
+        join(), if given, is called for a follower before it shares
+        the result; if it raises (e.g. rate limited) the follower is
+        turned away and not counted as coalesced.
+        """
+
+        with self._lock:
+
+            future = self._calls.get(key)
+
+            if future is None:
+
+                future = start()
+
+                self._calls[key] = future
+                self._stats["executions"] += 1
+
+                leader = True
+
+            else:
+                leader = False
+
+        if leader:
+            future.add_done_callback(lambda f: self._forget(key, f))
+            return future, True
+
+        if join is not None:
+            join()
+
+        with self._lock:
+            self._stats["coalesced"] += 1
+
+        return future, False
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Blocking variant: the leader runs fn in the calling thread.
+        """
+
+        def start():
+            f = Future()
+            f.set_running_or_notify_cancel()
+            return f
+
+        future, leader = self.join_or_start(key, start)
+
+        if leader:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        return future.result()
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            return {
+                "executions": self._stats["executions"],
+                # Each coalesced call is one execution saved
+                "saved_executions": self._stats["coalesced"],
+                "in_flight": len(self._calls),
+            }
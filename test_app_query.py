@@ -0,0 +1,80 @@
+# test_app_query.py
+
+import os
+
+# Import app without AWS: secrets come from the env instead
+os.environ.setdefault("APP_SECRET_JSON", "{}")
+os.environ.setdefault("LANGCHAIN_API_KEY", "test")
+
+from fastapi.testclient import TestClient
+
+import app
+import tools.search_documents as search_module
+
+
+def test_rest_query_runs_agent_with_channel_and_user():
+    """
+    POST /api/v1/query reaches run_agent with its channel/user_id
+    kwargs (they must not collide with submit_admitted's own).
+    """
+
+    calls = []
+
+    def fake_run_agent(question, channel=None, user_id=None):
+        calls.append((question, channel, user_id))
+        return "answer"
+
+    original = app.run_agent
+    app.run_agent = fake_run_agent
+
+    try:
+        with TestClient(app.app) as client:
+            response = client.post(
+                "/api/v1/query",
+                json={"question": "hello", "options": {"user_id": "u1"}},
+            )
+    finally:
+        app.run_agent = original
+
+    assert response.status_code == 200, response.text
+    assert response.json()["answer"].startswith("answer")
+    assert calls == [("hello", "rest", "u1")]
+
+
+def test_search_awaits_async_llm():
+    """
+    POST /api/v1/search answers through acall_claude_simple.
+    """
+
+    prompts = []
+
+    async def fake_acall(prompt):
+        prompts.append(prompt)
+        return "async answer"
+
+    patched = {
+        "prepare_search_answer": lambda query, top_k, two_phase: {"prompt": "P", "response": {}},
+        "complete_search_answer": lambda prepared, answer: {"answer": answer},
+        "acall_claude_simple": fake_acall,
+    }
+    originals = {name: getattr(search_module, name) for name in patched}
+
+    for name, value in patched.items():
+        setattr(search_module, name, value)
+
+    try:
+        with TestClient(app.app) as client:
+            response = client.post("/api/v1/search", json={"query": "hello"})
+    finally:
+        for name, value in originals.items():
+            setattr(search_module, name, value)
+
+    assert response.status_code == 200, response.text
+    assert response.json() == {"results": {"answer": "async answer"}}
+    assert prompts == ["P"]
+
+
+if __name__ == "__main__":
+    test_rest_query_runs_agent_with_channel_and_user()
+    test_search_awaits_async_llm()
+    print("✅ app query tests passed")
@@ -0,0 +1,119 @@
+# test_bedrock_invoke.py
+
+import asyncio
+import time
+
+from botocore.exceptions import ClientError
+
+from bedrock_invoke import CircuitBreaker, CircuitOpen, ainvoke_with_resilience, invoke_with_resilience, _model
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code}}, "InvokeModel")
+
+
+def test_non_retryable_error_frees_half_open_trial():
+    """
+    A ValidationException during the half-open trial must not leave the
+    breaker stuck rejecting every later call.
+    """
+
+    model_id = "test-half-open-validation"
+    breaker = _model(model_id).breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+
+    def unavailable():
+        raise client_error("ServiceUnavailableException")
+
+    def invalid():
+        raise client_error("ValidationException")
+
+    try:
+        invoke_with_resilience(model_id, unavailable, max_attempts=1)
+    except ClientError:
+        pass
+
+    assert breaker.state == "open"
+
+    # Trial call (reset_seconds=0 → half-open) fails non-retryably
+    try:
+        invoke_with_resilience(model_id, invalid, max_attempts=1)
+    except ClientError:
+        pass
+
+    # Next call must be allowed through, and close the breaker
+    try:
+        result = invoke_with_resilience(model_id, lambda: "ok", max_attempts=1)
+    except CircuitOpen:
+        raise AssertionError("breaker stuck with a trial in flight")
+
+    assert result == "ok"
+    assert breaker.state == "closed"
+
+
+def test_hung_call_is_bounded_by_deadline():
+    """
+    An attempt that never returns gives up at deadline_seconds, not at
+    the client's read timeout.
+    """
+
+    start = time.monotonic()
+
+    try:
+        invoke_with_resilience("test-hung-call", lambda: time.sleep(2), deadline_seconds=0.2)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("hung call returned")
+
+    assert time.monotonic() - start < 1.0
+
+
+def test_hung_call_counts_as_breaker_failure():
+    """
+    Hitting the deadline is a retryable failure: enough of them open
+    the breaker.
+    """
+
+    model_id = "test-hung-breaker"
+    breaker = _model(model_id).breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+
+    try:
+        invoke_with_resilience(model_id, lambda: time.sleep(1), max_attempts=1, deadline_seconds=0.1)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("hung call returned")
+
+    assert breaker.state == "open"
+
+
+def test_async_hung_call_is_bounded_and_opens_breaker():
+    """
+    The async wrapper applies the same deadline and breaker accounting.
+    """
+
+    model_id = "test-async-hung"
+    breaker = _model(model_id).breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+
+    async def hung():
+        await asyncio.sleep(2)
+
+    start = time.monotonic()
+
+    try:
+        asyncio.run(ainvoke_with_resilience(model_id, hung, max_attempts=1, deadline_seconds=0.1))
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("hung call returned")
+
+    assert time.monotonic() - start < 1.0
+    assert breaker.state == "open"
+
+
+if __name__ == "__main__":
+    test_non_retryable_error_frees_half_open_trial()
+    test_hung_call_is_bounded_by_deadline()
+    test_hung_call_counts_as_breaker_failure()
+    test_async_hung_call_is_bounded_and_opens_breaker()
+    print("✅ bedrock_invoke tests passed")
@@ -0,0 +1,38 @@
+# test_single_flight.py
+
+from concurrent.futures import Future
+
+from single_flight import SingleFlight
+
+
+def test_rejected_follower_is_not_counted():
+    """
+    Only followers that actually share the leader's run count as
+    saved executions.
+    """
+
+    flights = SingleFlight()
+    running = Future()
+
+    _, leader = flights.join_or_start("q", lambda: running)
+    assert leader
+
+    def reject():
+        raise RuntimeError("rate limited")
+
+    try:
+        flights.join_or_start("q", lambda: None, join=reject)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("follower was not turned away")
+
+    future, leader = flights.join_or_start("q", lambda: None, join=lambda: None)
+
+    assert not leader and future is running
+    assert flights.stats()["saved_executions"] == 1
+
+
+if __name__ == "__main__":
+    test_rejected_follower_is_not_counted()
+    print("✅ single_flight tests passed")
@@ -1,48 +1,25 @@
 from langchain.tools import tool
 from typing import List, Dict
+import asyncio
+import copy
+import hashlib
+import os
 import re
-import math
-
-from utils import search_documents
-from llm import call_claude_simple
-from lang_cache_utils import langcache_store, langcache_lookup
-
-
-# ============================================================
-# TOKENIZATION
-# ============================================================
-
-def tokenize(text: str):
-
-    text = text.lower()
-
-    text = re.sub(r"[^a-z0-9]", " ", text)
-
-    return [t for t in text.split() if len(t) > 1]
-
-
-# ============================================================
-# CHUNK SCORING
-# ============================================================
-
-def score_chunk(query, chunk):
-
-    q_tokens = tokenize(query)
-
-    c_tokens = tokenize(chunk)
-
-    if not q_tokens or not c_tokens:
-        return 0
-
-    overlap = len(set(q_tokens) & set(c_tokens)) / len(q_tokens)
-
-    density = sum(t in q_tokens for t in c_tokens) / len(c_tokens)
-
-    numeric = len(re.findall(r"\d+", chunk)) / len(c_tokens)
-
-    length_penalty = math.log(len(c_tokens) + 1)
-
-    return (overlap * 3 + density * 8 + numeric * 5) / length_penalty
+import time
+
+from utils import (
+    search_documents,
+    search_documents_batch,
+    fetch_chunk_fields,
+    get_corpus_version,
+    RRF_K,
+)
+from cache_utils import TTLLRUCache, normalize_text
+from context_packer import pack_context
+from lexical_features import tokenize, score_chunks
+from llm import acall_claude_simple, call_claude_simple, stream_claude_simple
+from lang_cache_utils import answer_cache_lookup, answer_cache_store
+from metrics import observe_stage, time_stage
 
 
 # ============================================================
@@ -59,10 +36,13 @@ def group_documents(chunks):
 
         grouped.setdefault(
             fname,
-            {"chunks": [], "score": 0}
+            {"chunks": [], "hits": [], "score": 0}
         )
 
-        grouped[fname]["chunks"].append(c["text"])
+        grouped[fname]["hits"].append(c)
+
+        if c.get("text") is not None:
+            grouped[fname]["chunks"].append(c["text"])
 
         grouped[fname]["score"] += c["score"]
 
@@ -116,122 +96,367 @@ def extract_semester_number(query):
 
 
 # ============================================================
-# TOOL
+# DOCUMENT BOOSTING
 # ============================================================
 
-@tool
-def search_documents_tool(input) -> dict:
+def boost_documents(grouped, query, use_text=True):
     """
-    Semantic document retrieval with deterministic document ranking.
+    Query-signal boosts per document. With use_text=False (two-phase
+    phase one) only filename signals apply.
     """
 
-    query = None
-    top_k = 20
+    filenames = extract_filenames(query)
 
-    if isinstance(input, dict):
+    identifiers = extract_identifiers(query)
 
-        query = input.get("full_question") or input.get("query")
+    semester_number = extract_semester_number(query)
 
-        top_k = input.get("top_k", 20)
+    q_tokens = set(tokenize(query))
 
-    elif isinstance(input, str):
+    for fname, data in grouped.items():
 
-        query = input.strip()
+        fname_lower = fname.lower()
 
-    if not query:
-        return {"answer": "Invalid query"}
+        # explicit filename match
+        if any(f in fname_lower for f in filenames):
+            data["score"] += 50
 
-    # --------------------------------------------------------
-    # DETECT DOWNLOAD INTENT (NEW SAFE CHANGE)
-    # --------------------------------------------------------
+        # semester detection
+        if semester_number and f"sem-{semester_number}" in fname_lower:
+            data["score"] += 60
 
-    download_requested = "download" in query.lower()
+        # identifier in filename
+        if any(i.lower() in fname_lower for i in identifiers):
+            data["score"] += 25
 
-    # --------------------------------------------------------
-    # VECTOR SEARCH
-    # --------------------------------------------------------
+        if use_text:
+
+            full_text = " ".join(data["chunks"]).lower()
+
+            # identifier inside document text
+            if any(i.lower() in full_text for i in identifiers):
+                data["score"] += 30
+
+        # keyword boost
+        if any(t in fname_lower for t in q_tokens):
+            data["score"] += 5
+
+
+def rank_documents(grouped):
+
+    return sorted(
+        grouped.items(),
+        key=lambda x: x[1]["score"],
+        reverse=True
+    )
+
+
+# ============================================================
+# RETRIEVAL
+# ============================================================
+
+TWO_PHASE_KNN = os.getenv("SEARCH_TWO_PHASE", "false").lower() == "true"
+
+TOP_DOCS = 3
 
-    raw = search_documents(query, top_k)
+
+def retrieve_documents(query, top_k=20, two_phase=TWO_PHASE_KNN):
+    """
+    Embedding + KNN + scoring + grouping + boosting.
+    Returns None when nothing matched, else ranked documents and stats.
+
+    two_phase: KNN returns keys, filenames and scores only. Documents
+    are pre-ranked on vector rank and filename signals; chunk text and
+    lexical features are then fetched (one pipelined HMGET) only for
+    the surviving top documents, which are re-scored as usual.
+    """
+
+    stats = {"two_phase": two_phase}
+
+    raw = search_documents(query, top_k, fetch_text=not two_phase, stats=stats)
+
+    return rank_hits(query, raw, two_phase, stats)
+
+
+def retrieve_documents_batch(queries, top_k=20, two_phase=TWO_PHASE_KNN, stats=None):
+    """
+    retrieve_documents() for several queries: concurrent embeddings and
+    one pipelined KNN round trip (see utils.search_documents_batch),
+    then per-query scoring and ranking. Returns one result per query,
+    in input order: the retrieval dict, None when nothing matched, or
+    the Exception if that query's search failed. If stats is a list, each query's stats
+    dict (embed_ms, search_ms, ...) is appended, matches or not.
+    """
+
+    batch_stats = []
+
+    batch = search_documents_batch(
+        queries, top_k, fetch_text=not two_phase, stats=batch_stats
+    )
+
+    results = []
+
+    for query, raw, search_stats in zip(queries, batch, batch_stats):
+
+        query_stats = {"two_phase": two_phase, **search_stats}
+
+        if isinstance(raw, Exception):
+            results.append(raw)
+        else:
+            results.append(rank_hits(query, raw, two_phase, query_stats))
+
+        if stats is not None:
+            stats.append(query_stats)
+
+    return results
+
+
+def rank_hits(query, raw, two_phase, stats):
+    """
+    Scoring, grouping and ranking of search hits (phase two fetch
+    first when two_phase). Returns None when nothing matched.
+    """
 
     if not raw:
-        return {"answer": "No documents found."}
+        return None
+
+    if two_phase:
+
+        # Phase one: rank position stands in for the chunk score
+        for position, r in enumerate(raw, start=1):
+            r["score"] = 1.0 / (RRF_K + position)
+
+        pre_grouped = group_documents(raw)
+
+        boost_documents(pre_grouped, query, use_text=False)
+
+        survivors = [
+            h
+            for _, data in rank_documents(pre_grouped)[:TOP_DOCS]
+            for h in data["hits"]
+        ]
+
+        fields = fetch_chunk_fields([h["key"] for h in survivors], stats=stats)
+
+        raw = []
+
+        for h in survivors:
+
+            if h["key"] in fields:
+                raw.append({**h, **fields[h["key"]]})
+
+        if not raw:
+            return None
 
     # --------------------------------------------------------
     # SCORE CHUNKS
     # --------------------------------------------------------
 
-    for r in raw:
+    # Batched over ingest-time features (see lexical_features.py)
+    with time_stage("chunk_scoring"):
+        scores = score_chunks(query, raw)
 
-        r["score"] = score_chunk(query, r["text"])
+    for r, score in zip(raw, scores):
+
+        r["score"] = float(score)
 
     grouped = group_documents(raw)
 
     # --------------------------------------------------------
-    # QUERY SIGNALS
+    # DOCUMENT BOOSTING + RANKING
     # --------------------------------------------------------
 
-    filenames = extract_filenames(query)
+    boost_documents(grouped, query)
 
-    identifiers = extract_identifiers(query)
+    ranked = rank_documents(grouped)
 
-    semester_number = extract_semester_number(query)
+    stats["bytes_transferred"] = stats.get("search_bytes", 0) + stats.get("fetch_bytes", 0)
 
-    q_tokens = set(tokenize(query))
+    stats["decode_ms"] = round(
+        stats.get("search_decode_ms", 0) + stats.get("fetch_decode_ms", 0), 3
+    )
+
+    return {
+        "grouped": grouped,
+        "ranked": ranked,
+        "top_docs": ranked[:TOP_DOCS],
+        "authoritative_doc": ranked[0][0],
+        "stats": stats,
+    }
+
+
+# ============================================================
+# ANSWER CACHE KEYS
+# ============================================================
+
+def context_fingerprint(top_docs):
+    """
+    Stable hash of the chunk keys that make up the prompt context.
+    Re-ingested or new documents change it; unrelated ingests do not.
+    """
+
+    keys = sorted(h["key"] for _, data in top_docs for h in data["hits"])
+
+    return hashlib.sha1("|".join(keys).encode("utf-8")).hexdigest()[:16]
+
+
+def answer_cache_key(query, fingerprint):
+
+    return f"Q:{normalize_text(query)}|ctx:{fingerprint}"
+
+
+# Last full response per question, stamped with the corpus version it
+# was built against. While the version is unchanged retrieval would
+# return the same chunks, so the response is reused as-is.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+recent_responses = TTLLRUCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl_seconds=RESPONSE_CACHE_TTL_SECONDS
+)
+
+
+def _read_corpus_version():
+
+    try:
+        return get_corpus_version()
+    except Exception as e:
+        print("Corpus version lookup failed:", str(e))
+        return None
+
+
+# ============================================================
+# ANSWER PREPARATION (SHARED BY BLOCKING + STREAMING PATHS)
+# ============================================================
+
+def parse_search_input(input):
+
+    query = None
+    top_k = 20
+    two_phase = TWO_PHASE_KNN
+
+    if isinstance(input, dict):
+
+        query = input.get("full_question") or input.get("query")
+
+        top_k = input.get("top_k", 20)
+
+        two_phase = input.get("two_phase", TWO_PHASE_KNN)
+
+    elif isinstance(input, str):
+
+        query = input.strip()
+
+    return query, top_k, two_phase
+
+
+# Pass as retrieval= when a retrieval already ran and matched nothing,
+# so prepare_search_answer answers "No documents found." without
+# searching again
+NO_MATCHES = {}
+
+
+def _resolve_retrieval(speculative, query, top_k, two_phase):
+    """
+    Use a retrieval started ahead of time (a Future or its result) when
+    available; otherwise, if it failed, or if it is still queued (then
+    cancelled), retrieve now.
+    """
+
+    if speculative is not None:
+
+        if not hasattr(speculative, "result"):
+            return speculative
+
+        # Still queued behind other requests' speculation: it would only
+        # add wait time, so drop it and retrieve inline
+        if speculative.cancel():
+            print("Speculative retrieval never started, retrieving inline")
+            return retrieve_documents(query, top_k, two_phase=two_phase)
+
+        try:
+            return speculative.result()
+        except Exception as e:
+            print("Speculative retrieval failed, retrieving again:", str(e))
+
+    return retrieve_documents(query, top_k, two_phase=two_phase)
+
+
+def prepare_search_answer(query, top_k=20, two_phase=TWO_PHASE_KNN, retrieval=None):
+    """
+    Everything up to the answer LLM call.
+    Returns {"response": ...} when no LLM call is needed (cache hit,
+    nothing found), otherwise the prompt plus what
+    complete_search_answer() needs.
+
+    retrieval: optional speculative retrieve_documents() result/Future
+    for the same query, top_k and two_phase.
+    """
 
     # --------------------------------------------------------
-    # DOCUMENT BOOSTING
+    # DETECT DOWNLOAD INTENT (NEW SAFE CHANGE)
     # --------------------------------------------------------
 
-    for fname, data in grouped.items():
+    download_requested = "download" in query.lower()
 
-        fname_lower = fname.lower()
+    # --------------------------------------------------------
+    # CORPUS VERSION SHORTCUT
+    # --------------------------------------------------------
 
-        full_text = " ".join(data["chunks"]).lower()
+    corpus_version = _read_corpus_version()
 
-        # explicit filename match
-        if any(f in fname_lower for f in filenames):
-            data["score"] += 50
+    response_key = f"{normalize_text(query)}|top_k={top_k}|two_phase={two_phase}"
 
-        # semester detection
-        if semester_number and f"sem-{semester_number}" in fname_lower:
-            data["score"] += 60
+    if corpus_version is not None:
 
-        # identifier in filename
-        if any(i.lower() in fname_lower for i in identifiers):
-            data["score"] += 25
+        entry = recent_responses.get(response_key)
 
-        # identifier inside document text
-        if any(i.lower() in full_text for i in identifiers):
-            data["score"] += 30
+        if entry and entry["corpus_version"] == corpus_version:
 
-        # keyword boost
-        if any(t in fname_lower for t in q_tokens):
-            data["score"] += 5
+            print(f"⚡ RESPONSE REUSED (corpus_version={corpus_version})")
+
+            response = copy.deepcopy(entry["response"])
+
+            response["trace"]["cache_hit"] = True
+
+            response["trace"]["cache_tier"] = "corpus_version"
+
+            return {"response": response}
 
     # --------------------------------------------------------
-    # RANK DOCUMENTS
+    # RETRIEVAL
     # --------------------------------------------------------
 
-    ranked = sorted(
-        grouped.items(),
-        key=lambda x: x[1]["score"],
-        reverse=True
-    )
+    retrieval = _resolve_retrieval(retrieval, query, top_k, two_phase)
 
-    authoritative_doc = ranked[0][0]
+    if not retrieval:
+        return {"response": {"answer": "No documents found."}}
 
-    top_docs = ranked[:3]
+    grouped = retrieval["grouped"]
+
+    authoritative_doc = retrieval["authoritative_doc"]
+
+    top_docs = retrieval["top_docs"]
+
+    print(
+        f"📦 RETRIEVAL bytes={retrieval['stats']['bytes_transferred']} "
+        f"decode_ms={retrieval['stats']['decode_ms']} "
+        f"two_phase={retrieval['stats']['two_phase']}"
+    )
 
     # --------------------------------------------------------
     # CONTEXT BUILD
     # --------------------------------------------------------
 
-    context = ""
-
-    for fname, data in top_docs:
+    # Adjacent chunks merged without overlap, packed to a token budget
+    context, context_stats = pack_context(top_docs)
 
-        for c in data["chunks"]:
-            context += c + "\n"
+    print(
+        f"🧱 CONTEXT tokens={context_stats['tokens_after']} "
+        f"saved={context_stats['tokens_saved']} "
+        f"segments={context_stats['segments']}"
+    )
 
     # --------------------------------------------------------
     # PROMPT
@@ -249,30 +474,15 @@ QUESTION:
 Provide the answer based only on the document text.
 """
 
-    cache_key = f"Q:{query}"
-
-    cached = langcache_lookup(cache_key)
-
-    if cached:
-
-        answer = cached
-        cache_hit = True
-
-    else:
-
-        answer = call_claude_simple(prompt)
-
-        langcache_store(cache_key, answer)
-
-        cache_hit = False
+    fingerprint = context_fingerprint(top_docs)
 
     # --------------------------------------------------------
-    # FINAL RESPONSE
+    # RESPONSE (ANSWER FILLED IN LATER)
     # --------------------------------------------------------
 
     response = {
 
-        "answer": answer,
+        "answer": None,
 
         "resolved_filenames": [authoritative_doc],
 
@@ -284,11 +494,174 @@ Provide the answer based only on the document text.
 
             "documents_used": [d[0] for d in top_docs],
 
-            "cache_hit": cache_hit
+            "cache_hit": False,
+
+            "context_fingerprint": fingerprint,
+
+            "corpus_version": corpus_version,
+
+            "retrieval": retrieval["stats"],
+
+            "context": context_stats
         }
     }
 
     if download_requested:
         response["download_requested"] = True
 
-    return response
\ No newline at end of file
+    prepared = {
+
+        "prompt": prompt,
+
+        "cache_key": answer_cache_key(query, fingerprint),
+
+        "cache_attributes": {"context": fingerprint},
+
+        "response_key": response_key,
+
+        "corpus_version": corpus_version,
+
+        "response": response
+    }
+
+    cached = answer_cache_lookup(
+
+        prepared["cache_key"],
+
+        attributes=prepared["cache_attributes"]
+    )
+
+    if cached:
+        return {"response": complete_search_answer(prepared, cached, cache_hit=True)}
+
+    return prepared
+
+
+def complete_search_answer(prepared, answer, cache_hit=False):
+    """
+    Fill in the answer and update the answer/response caches.
+    """
+
+    response = prepared["response"]
+
+    response["answer"] = answer
+
+    response["trace"]["cache_hit"] = cache_hit
+
+    if not cache_hit:
+
+        answer_cache_store(
+
+            prepared["cache_key"],
+
+            answer,
+
+            attributes=prepared["cache_attributes"]
+        )
+
+    if prepared["corpus_version"] is not None:
+
+        recent_responses.set(prepared["response_key"], {
+
+            "corpus_version": prepared["corpus_version"],
+
+            "response": copy.deepcopy(response)
+        })
+
+    return response
+
+
+def answer_search(query, top_k=20, two_phase=TWO_PHASE_KNN, retrieval=None):
+    """
+    Blocking search + answer; what search_documents_tool runs.
+    """
+
+    prepared = prepare_search_answer(query, top_k, two_phase, retrieval=retrieval)
+
+    if "prompt" not in prepared:
+        return prepared["response"]
+
+    with time_stage("answer_llm"):
+        answer = call_claude_simple(prepared["prompt"])
+
+    return complete_search_answer(prepared, answer)
+
+
+async def aanswer_search(input):
+    """
+    Async variant of search_documents_tool for async handlers.
+    Retrieval and cache I/O still block, so they run in a worker
+    thread; the answer LLM call is awaited without holding one.
+    """
+
+    query, top_k, two_phase = parse_search_input(input)
+
+    if not query:
+        return {"answer": "Invalid query"}
+
+    prepared = await asyncio.to_thread(prepare_search_answer, query, top_k, two_phase)
+
+    if "prompt" not in prepared:
+        return prepared["response"]
+
+    llm_start = time.perf_counter()
+
+    answer = await acall_claude_simple(prepared["prompt"])
+
+    observe_stage("answer_llm", time.perf_counter() - llm_start)
+
+    return await asyncio.to_thread(complete_search_answer, prepared, answer)
+
+
+def stream_search_answer(input, retrieval=None):
+    """
+    Streaming variant of search_documents_tool.
+    Yields ("token", text) as the answer is generated, then
+    ("result", response) with the same dict the tool returns.
+    """
+
+    query, top_k, two_phase = parse_search_input(input)
+
+    if not query:
+        response = {"answer": "Invalid query"}
+        yield "token", response["answer"]
+        yield "result", response
+        return
+
+    prepared = prepare_search_answer(query, top_k, two_phase, retrieval=retrieval)
+
+    if "prompt" not in prepared:
+        yield "token", prepared["response"]["answer"]
+        yield "result", prepared["response"]
+        return
+
+    parts = []
+
+    llm_start = time.perf_counter()
+
+    for text in stream_claude_simple(prepared["prompt"]):
+        parts.append(text)
+        yield "token", text
+
+    # Wall time of the whole stream (includes the consumer's pace)
+    observe_stage("answer_llm", time.perf_counter() - llm_start)
+
+    yield "result", complete_search_answer(prepared, "".join(parts))
+
+
+# ============================================================
+# TOOL
+# ============================================================
+
+@tool
+def search_documents_tool(input) -> dict:
+    """
+    Semantic document retrieval with deterministic document ranking.
+    """
+
+    query, top_k, two_phase = parse_search_input(input)
+
+    if not query:
+        return {"answer": "Invalid query"}
+
+    return answer_search(query, top_k, two_phase)
@@ -1,57 +1,80 @@
 import json
+import os
 import boto3
 import redis
-import struct
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from redis.commands.search.query import Query
 from urllib.parse import unquote_plus
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError
 
+from cache_utils import EmbeddingCache
+from vector_utils import parse_embedding, to_float32_bytes
+from bedrock_invoke import invoke_with_resilience
+from config import LazyClient, get_client, get_secret
+from metrics import observe_stage, time_stage
+
 # Configuration
 REGION = "eu-west-1"
+# Searches go through the alias the ingest Lambda keeps pointed at the
+# live index; it starts out on REDIS_INDEX_NAME
 REDIS_INDEX_NAME = "doc_index"
+REDIS_INDEX_ALIAS = os.getenv("REDIS_INDEX_ALIAS", "doc_index_live")
 VECTOR_DIM = 1024
 KEY_PREFIX = "doc:"
 BUCKET_NAME = "family-docs-raw"
 TABLE_NAME = "DocumentMetadata"
 MODEL_ID = "amazon.titan-embed-text-v2:0"
 
-# AWS Clients
-s3 = boto3.client("s3", region_name=REGION)
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
-bedrock = boto3.client("bedrock-runtime", region_name=REGION)
-secretsmanager = boto3.client("secretsmanager", region_name=REGION)
+# HNSW only: per-query EF_RUNTIME (leave unset for FLAT indexes)
+KNN_EF_RUNTIME = os.getenv("KNN_EF_RUNTIME")
 
-# --------------------------------------------------------
-# SECRETS
-# --------------------------------------------------------
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "2048"))
+EMBED_CACHE_TTL_SECONDS = int(os.getenv("EMBED_CACHE_TTL_SECONDS", "3600"))
+EMBED_CACHE_REDIS_TTL_SECONDS = int(os.getenv("EMBED_CACHE_REDIS_TTL_SECONDS", str(7 * 24 * 3600)))
 
-def get_secrets(secret_name):
+# Embedding calls are idempotent: race a duplicate once one is slower than p95
+EMBED_HEDGING = os.getenv("EMBED_HEDGING", "true").lower() == "true"
+EMBED_DEADLINE_SECONDS = float(os.getenv("EMBED_DEADLINE_SECONDS", "10"))
 
-    return json.loads(
-        secretsmanager.get_secret_value(
-            SecretId=secret_name
-        )["SecretString"]
-    )
+# Concurrent query embeddings for batch search
+EMBED_BATCH_WORKERS = int(os.getenv("EMBED_BATCH_WORKERS", "8"))
 
-secret = get_secrets("dev/python/api")
+# AWS Clients (built on first use, see config.LazyClient)
+s3 = get_client("s3")
+dynamodb = LazyClient("dynamodb@" + REGION, lambda: boto3.resource("dynamodb", region_name=REGION))
+# Retries live in bedrock_invoke; botocore makes a single attempt
+bedrock = LazyClient("bedrock-runtime@" + REGION, lambda: boto3.client(
+    "bedrock-runtime",
+    region_name=REGION,
+    config=Config(max_pool_connections=20, retries={"mode": "standard", "max_attempts": 1})
+))
 
 # --------------------------------------------------------
 # REDIS CONNECTION
 # --------------------------------------------------------
 
-redis_conn = redis.Redis(
+def _connect_redis():
 
-    host=secret["REDIS_HOST"],
+    secret = get_secret()
 
-    port=secret["REDIS_PORT"],
+    return redis.Redis(
 
-    username=secret["REDIS_USER"],
+        host=secret["REDIS_HOST"],
 
-    password=secret["REDIS_PASS"],
+        port=secret["REDIS_PORT"],
 
-    decode_responses=False
-)
+        username=secret["REDIS_USER"],
+
+        password=secret["REDIS_PASS"],
+
+        decode_responses=False
+    )
+
+redis_conn = LazyClient("redis", _connect_redis)
 
 # --------------------------------------------------------
 # EMBEDDING
@@ -59,177 +82,648 @@ redis_conn = redis.Redis(
 
 def get_embedding(text):
 
-    response = bedrock.invoke_model(
+    body = json.dumps({"inputText": text})
+
+    def call():
+
+        response = bedrock.invoke_model(
+
+            modelId=MODEL_ID,
+
+            contentType="application/json",
+
+            accept="application/json",
+
+            body=body
+        )
+
+        return response["body"].read()
+
+    raw = invoke_with_resilience(
 
-        modelId=MODEL_ID,
+        MODEL_ID,
 
-        contentType="application/json",
+        call,
 
-        accept="application/json",
+        hedge=EMBED_HEDGING,
 
-        body=json.dumps({"inputText": text})
+        deadline_seconds=EMBED_DEADLINE_SECONDS
     )
 
-    embedding = json.loads(response["body"].read())["embedding"]
+    # float32 ndarray, parsed without boxing each element
+    return parse_embedding(raw)
+
+
+# --------------------------------------------------------
+# QUERY EMBEDDING CACHE (LOCAL LRU → REDIS → BEDROCK)
+# --------------------------------------------------------
+
+embedding_cache = EmbeddingCache(
+
+    get_embedding,
+
+    redis_conn,
+
+    namespace=MODEL_ID,
+
+    max_entries=EMBED_CACHE_MAX_ENTRIES,
+
+    ttl_seconds=EMBED_CACHE_TTL_SECONDS,
+
+    redis_ttl_seconds=EMBED_CACHE_REDIS_TTL_SECONDS
+)
+
+
+def get_query_embedding(text):
 
-    return embedding
+    with time_stage("query_embedding"):
+
+        return embedding_cache.get(text)
+
+
+_embed_executor = ThreadPoolExecutor(
+
+    max_workers=EMBED_BATCH_WORKERS,
+
+    thread_name_prefix="query-embed"
+)
+
+
+def _timed_query_embedding(text):
+
+    start = time.perf_counter()
+
+    vector = get_query_embedding(text)
+
+    return vector, round((time.perf_counter() - start) * 1000, 2)
+
+
+def embed_queries(queries):
+    """
+    Query embeddings, fetched concurrently for more than one query.
+    Returns [(vector, embed_ms)] in input order.
+    """
+
+    if len(queries) == 1:
+        return [_timed_query_embedding(queries[0])]
+
+    return list(_embed_executor.map(_timed_query_embedding, queries))
+
+
+def get_embedding_cache_stats():
+
+    return embedding_cache.stats()
 
 
 # --------------------------------------------------------
-# FLOAT LIST → BYTES
+# PIPELINED FT.SEARCH (ONE ROUND TRIP FOR N QUERIES)
 # --------------------------------------------------------
 
-def to_float32_bytes(vector):
+def _payload_bytes(raw):
+
+    if isinstance(raw, (bytes, str)):
+        return len(raw)
+
+    if isinstance(raw, (list, tuple)):
+        return sum(_payload_bytes(r) for r in raw)
+
+    return 0
+
+
+_search_alias_ready = False
+_search_alias_lock = threading.Lock()
+
+
+def ensure_search_alias():
+    """
+    Make sure REDIS_INDEX_ALIAS exists before searching through it: if
+    no ingest has created it yet, point it at REDIS_INDEX_NAME. Checked
+    once per process; retried on later calls until the index exists.
+    """
+
+    global _search_alias_ready
+
+    if _search_alias_ready:
+        return
+
+    with _search_alias_lock:
+
+        if _search_alias_ready:
+            return
+
+        try:
+            redis_conn.ft(REDIS_INDEX_ALIAS).info()
+
+        except redis.ResponseError:
+
+            try:
+                redis_conn.ft(REDIS_INDEX_NAME).aliasadd(REDIS_INDEX_ALIAS)
+                print(f"Alias {REDIS_INDEX_ALIAS} → {REDIS_INDEX_NAME}")
+
+            except redis.ResponseError as e:
+
+                # Lost a race with another process or the Lambda: fine
+                if "already exists" not in str(e).lower():
+                    print(f"⚠️ Search alias {REDIS_INDEX_ALIAS} unavailable:", str(e))
+                    return
+
+        _search_alias_ready = True
+
+
+def run_searches(searches, stats=None):
+    """
+    Run several FT.SEARCH queries in one pipelined round trip.
+
+    searches: list of (Query, query_params or None)
+    Returns one Result (or the Exception raised) per query, in order.
+    If stats is a list, one {"bytes", "decode_ms"} dict per query is
+    appended to it.
+    """
+
+    ensure_search_alias()
+
+    ft = redis_conn.ft(REDIS_INDEX_ALIAS)
+
+    pipe = redis_conn.pipeline(transaction=False)
+
+    for q, params in searches:
+
+        args, _ = ft._mk_query_args(q, query_params=params)
+
+        pipe.execute_command("FT.SEARCH", *args)
+
+    start = time.perf_counter()
+
+    raw_results = pipe.execute(raise_on_error=False)
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    results = []
+
+    for (q, _), raw in zip(searches, raw_results):
+
+        if isinstance(raw, Exception):
+
+            results.append(raw)
+
+            if stats is not None:
+                stats.append({"bytes": 0, "decode_ms": 0.0})
+
+            continue
+
+        decode_start = time.perf_counter()
+
+        results.append(
+
+            ft._parse_results("FT.SEARCH", raw, query=q, duration=elapsed_ms)
+        )
+
+        if stats is not None:
+
+            stats.append({
+
+                "bytes": _payload_bytes(raw),
+
+                "decode_ms": round((time.perf_counter() - decode_start) * 1000, 3)
+            })
+
+    return results
+
+
+# --------------------------------------------------------
+# RESULT DECODING
+# --------------------------------------------------------
+
+def _decode(value):
+
+    if isinstance(value, bytes):
+        return value.decode()
+
+    return value
+
+
+CHUNK_FEATURE_FIELDS = ("token_counts", "token_count", "numeric_count")
+
+
+def _doc_to_hit(doc, score):
+
+    hit = {
+
+        "key": _decode(doc.id),
+
+        "document_id": _decode(getattr(doc, "document_id", None)),
+
+        "filename": _decode(getattr(doc, "filename", None)),
+
+        "text": _decode(getattr(doc, "text", None)),
+
+        "score": score
+    }
+
+    # Precomputed lexical features (absent on legacy chunks)
+    for field in CHUNK_FEATURE_FIELDS:
+
+        value = getattr(doc, field, None)
+
+        if value is not None:
+            hit[field] = _decode(value)
+
+    return hit
+
+
+# --------------------------------------------------------
+# RECIPROCAL RANK FUSION
+# --------------------------------------------------------
+
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """
+    Merge ranked hit lists by key: score = sum(1 / (k + rank)).
+    ranked_lists: {source_name: [hit, ...]} (best first)
+    Each fused hit carries per-source scores and ranks in "scores".
+    """
+
+    fused = {}
+
+    for source, hits in ranked_lists.items():
+
+        for rank, hit in enumerate(hits, start=1):
+
+            entry = fused.get(hit["key"])
 
-    return struct.pack(f"{len(vector)}f", *vector)
+            if entry is None:
+
+                entry = dict(hit)
+
+                entry["scores"] = {"rrf": 0.0}
+
+                fused[hit["key"]] = entry
+
+            entry["scores"][source] = hit["score"]
+
+            entry["scores"][f"{source}_rank"] = rank
+
+            entry["scores"]["rrf"] += 1.0 / (k + rank)
+
+    merged = sorted(
+
+        fused.values(),
+
+        key=lambda h: h["scores"]["rrf"],
+
+        reverse=True
+    )
+
+    for hit in merged:
+
+        hit["score"] = round(hit["scores"]["rrf"], 6)
+
+    return merged
 
 
 # --------------------------------------------------------
 # SEARCH FUNCTION (HYBRID VECTOR + KEYWORD)
 # --------------------------------------------------------
 
-def search_documents(query, top_k=5, search_mode="vector"):
+IDENTIFIER_PATTERN = re.compile(r"[A-Z0-9]{6,}")
 
-    query_embedding = get_embedding(query)
 
-    query_vec_bytes = to_float32_bytes(query_embedding)
+def _hit_fields(fetch_text):
 
-    # ----------------------------------------------------
-    # VECTOR SEARCH
-    # ----------------------------------------------------
+    # Two-phase mode: ids, filenames and scores only
+    if not fetch_text:
+        return ("document_id", "filename")
 
-    q = (
+    return ("document_id", "filename", "text", *CHUNK_FEATURE_FIELDS)
 
-        Query(f"*=>[KNN {top_k} @embedding $vec]")
+
+def _knn_query(top_k, fetch_text=True):
+
+    knn_clause = f"KNN {top_k} @embedding $vec"
+
+    if KNN_EF_RUNTIME:
+
+        knn_clause += " EF_RUNTIME $ef"
+
+    return (
+
+        Query(f"*=>[{knn_clause}]")
 
         .return_fields(
-            "document_id",
-            "filename",
-            "text",
+            *_hit_fields(fetch_text),
             "__embedding_score"
         )
 
+        .paging(0, top_k)
+
         .dialect(2)
     )
 
-    result = redis_conn.ft(REDIS_INDEX_NAME).search(
 
-        q,
+def _knn_params(query_vec_bytes):
 
-        query_params={"vec": query_vec_bytes}
-    )
+    params = {"vec": query_vec_bytes}
+
+    if KNN_EF_RUNTIME:
+
+        params["ef"] = int(KNN_EF_RUNTIME)
+
+    return params
+
+
+def _keyword_query(query, top_k, fetch_text=True):
+
+    safe_query = query.replace(".", " ").replace("-", " ")
+
+    return Query(
 
-    vector_results = []
+        f"@text:{safe_query}"
 
-    for doc in result.docs:
+    ).return_fields(
 
-        filename = doc.filename
-        text = doc.text
-        document_id = doc.document_id
+        *_hit_fields(fetch_text)
 
-        if isinstance(filename, bytes):
-            filename = filename.decode()
+    ).paging(0, top_k)
 
-        if isinstance(text, bytes):
-            text = text.decode()
 
-        if isinstance(document_id, bytes):
-            document_id = document_id.decode()
+def _sum_search_stats(search_stats, indexes):
 
-        score = doc.__dict__.get("__embedding_score", 0)
+    return {
 
-        vector_results.append({
+        "search_bytes": sum(search_stats[i]["bytes"] for i in indexes),
 
-            "document_id": document_id,
+        "search_decode_ms": round(sum(search_stats[i]["decode_ms"] for i in indexes), 3)
+    }
 
-            "filename": filename,
 
-            "text": text,
+def search_documents_batch(queries, top_k=5, search_mode="vector", fetch_text=True, stats=None):
+    """
+    search_documents() for several queries at once: embeddings are
+    fetched concurrently and every FT.SEARCH goes out in one pipeline
+    (plus one more for any keyword fallbacks).
 
-            "score": score
-        })
+    Returns one hit list per query, in input order; a query whose KNN
+    search failed gets the Exception instead (the others are unaffected).
+    If stats is a list,
+    one dict per query is appended: embed_ms, search_ms (the shared
+    round trip(s) the query took part in), search_bytes,
+    search_decode_ms and keyword_fallback.
+    """
+
+    embeddings = embed_queries(queries)
+
+    searches = []
+
+    plans = []
+
+    for query, (query_embedding, _) in zip(queries, embeddings):
+
+        hybrid = search_mode == "hybrid" or bool(IDENTIFIER_PATTERN.search(query))
+
+        plan = {"hybrid": hybrid, "searches": [len(searches)]}
+
+        searches.append((_knn_query(top_k, fetch_text), _knn_params(to_float32_bytes(query_embedding))))
+
+        if hybrid:
+
+            plan["searches"].append(len(searches))
+
+            searches.append((_keyword_query(query, top_k, fetch_text), None))
+
+        plans.append(plan)
+
+    search_stats = []
+
+    start = time.perf_counter()
+
+    results = run_searches(searches, stats=search_stats)
+
+    search_elapsed = time.perf_counter() - start
+
+    observe_stage("redis_knn", search_elapsed)
+
+    search_ms = round(search_elapsed * 1000, 2)
 
     # ----------------------------------------------------
-    # IDENTIFIER DETECTION
+    # VECTOR RESULTS
     # ----------------------------------------------------
 
-    identifier_pattern = re.compile(r"[A-Z0-9]{6,}")
+    for plan in plans:
+
+        vector_result = results[plan["searches"][0]]
+
+        plan["search_ms"] = search_ms
+
+        if isinstance(vector_result, Exception):
+
+            plan["error"] = vector_result
+
+            continue
+
+        plan["vector"] = [
+
+            _doc_to_hit(doc, doc.__dict__.get("__embedding_score", 0))
 
-    identifier_found = identifier_pattern.search(query)
+            for doc in vector_result.docs
+        ]
 
     # ----------------------------------------------------
-    # IF NOT IDENTIFIER → RETURN VECTOR
+    # KEYWORD FALLBACK (PLAIN QUERIES KNN FOUND NOTHING FOR)
     # ----------------------------------------------------
 
-    if not identifier_found:
+    fallback = [
 
-        if vector_results:
+        (query, plan) for query, plan in zip(queries, plans)
+
+        if "error" not in plan and not plan["hybrid"] and not plan["vector"]
+    ]
+
+    if fallback:
+
+        offset = len(searches)
+
+        start = time.perf_counter()
+
+        results += run_searches(
+
+            [(_keyword_query(query, top_k, fetch_text), None) for query, _ in fallback],
+
+            stats=search_stats
+        )
 
-            return vector_results
+        fallback_elapsed = time.perf_counter() - start
+
+        observe_stage("keyword_fallback", fallback_elapsed)
+
+        fallback_ms = round(fallback_elapsed * 1000, 2)
+
+        for i, (_, plan) in enumerate(fallback):
+
+            plan["searches"].append(offset + i)
+
+            plan["search_ms"] += fallback_ms
 
     # ----------------------------------------------------
-    # KEYWORD SEARCH (IDENTIFIERS / FALLBACK)
+    # MERGE
     # ----------------------------------------------------
 
-    safe_query = query.replace(".", " ").replace("-", " ")
+    batch = []
 
-    keyword_results = []
+    for (query, plan), (_, embed_ms) in zip(zip(queries, plans), embeddings):
 
-    try:
+        if stats is not None:
 
-        keyword_query = Query(
+            stats.append({
 
-            f"@text:{safe_query}"
+                "embed_ms": embed_ms,
 
-        ).return_fields(
+                "search_ms": plan["search_ms"],
 
-            "document_id",
-            "filename",
-            "text"
+                "keyword_fallback": not plan["hybrid"] and len(plan["searches"]) > 1,
 
-        ).paging(0, top_k)
+                **_sum_search_stats(search_stats, plan["searches"])
+            })
 
-        result = redis_conn.ft(REDIS_INDEX_NAME).search(keyword_query)
+        if "error" in plan:
 
-        for doc in result.docs:
+            print(f"KNN search failed for '{query}':", str(plan["error"]))
 
-            filename = doc.filename
-            text = doc.text
-            document_id = doc.document_id
+            batch.append(plan["error"])
 
-            if isinstance(filename, bytes):
-                filename = filename.decode()
+            continue
 
-            if isinstance(text, bytes):
-                text = text.decode()
+        # Plain query with KNN hits
+        if len(plan["searches"]) == 1:
 
-            if isinstance(document_id, bytes):
-                document_id = document_id.decode()
+            batch.append(plan["vector"])
 
-            keyword_results.append({
+            continue
 
-                "document_id": document_id,
+        keyword_result = results[plan["searches"][-1]]
 
-                "filename": filename,
+        keyword_results = []
 
-                "text": text,
+        if isinstance(keyword_result, Exception):
 
-                "score": 0
-            })
+            print("Keyword fallback search failed:", str(keyword_result))
 
-    except Exception as e:
+        else:
 
-        print("Keyword fallback search failed:", str(e))
+            keyword_results = [
 
-    # ----------------------------------------------------
-    # RETURN BEST AVAILABLE RESULTS
-    # ----------------------------------------------------
+                _doc_to_hit(doc, 0)
+
+                for doc in keyword_result.docs
+            ]
+
+        if not plan["hybrid"]:
+
+            batch.append(keyword_results)
+
+            continue
+
+        # Hybrid → rank fusion
+        batch.append(reciprocal_rank_fusion({
+
+            "vector": plan["vector"],
 
-    if keyword_results:
+            "keyword": keyword_results
+        })[:top_k])
 
-        return keyword_results
+    return batch
 
-    return vector_results
+
+def search_documents(query, top_k=5, search_mode="vector", fetch_text=True, stats=None):
+    """
+    Plain queries: KNN only.
+    Identifier-like queries (or search_mode="hybrid"): KNN and @text
+    queries pipelined in one round trip, merged with reciprocal rank
+    fusion. Hits carry per-source scores under "scores".
+
+    fetch_text=False is phase one of a two-phase fetch: hits carry keys,
+    filenames and scores only; use fetch_chunk_fields() for survivors.
+    If stats is a dict it receives bytes transferred and decode time.
+    """
+
+    batch_stats = []
+
+    hits = search_documents_batch(
+
+        [query], top_k, search_mode, fetch_text, stats=batch_stats
+    )[0]
+
+    if isinstance(hits, Exception):
+        raise hits
+
+    if stats is not None:
+
+        stats["search_bytes"] = batch_stats[0]["search_bytes"]
+
+        stats["search_decode_ms"] = batch_stats[0]["search_decode_ms"]
+
+    return hits
+
+
+# --------------------------------------------------------
+# PHASE TWO: CHUNK FIELDS FOR SURVIVORS
+# --------------------------------------------------------
+
+def fetch_chunk_fields(keys, fields=("text", *CHUNK_FEATURE_FIELDS), stats=None):
+    """
+    Pipelined HMGET of chunk fields for the given Redis keys.
+    Returns {key: {field: value}}; missing keys are skipped.
+    If stats is a dict it receives bytes transferred and decode time.
+    """
+
+    pipe = redis_conn.pipeline(transaction=False)
+
+    for key in keys:
+        pipe.hmget(key, *fields)
+
+    rows = pipe.execute()
+
+    decode_start = time.perf_counter()
+
+    out = {}
+
+    for key, values in zip(keys, rows):
+
+        if not any(v is not None for v in values):
+            continue
+
+        out[key] = {
+
+            f: _decode(v)
+
+            for f, v in zip(fields, values)
+
+            if v is not None
+        }
+
+    if stats is not None:
+
+        stats["fetch_bytes"] = _payload_bytes(rows)
+
+        stats["fetch_decode_ms"] = round((time.perf_counter() - decode_start) * 1000, 3)
+
+    return out
+
+
+# --------------------------------------------------------
+# CORPUS VERSION
+# --------------------------------------------------------
+
+# Incremented by the vector processor Lambda on every ingest/delete
+CORPUS_VERSION_KEY = "corpus:version"
+
+
+def get_corpus_version():
+
+    value = redis_conn.get(CORPUS_VERSION_KEY)
+
+    return int(value) if value else 0
 
 
 # --------------------------------------------------------
@@ -238,6 +732,13 @@ def search_documents(query, top_k=5, search_mode="vector"):
 
 def get_all_document_metadata():
 
+    with time_stage("dynamodb_scan"):
+
+        return _scan_document_metadata()
+
+
+def _scan_document_metadata():
+
     table = dynamodb.Table(TABLE_NAME)
 
     response = table.scan()
@@ -262,6 +763,14 @@ def get_all_document_metadata():
 
 def generate_presigned_url(document_id, filename):
 
+    # Metadata lookup + signing: what a download request waits for
+    with time_stage("presign"):
+
+        return _presigned_url(document_id)
+
+
+def _presigned_url(document_id):
+
     table = dynamodb.Table(TABLE_NAME)
 
     response = table.get_item(
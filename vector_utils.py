@@ -0,0 +1,59 @@
+# vector_utils.py
+
+import json
+
+import numpy as np
+
+
+# ============================================================
+# BEDROCK RESPONSE → FLOAT32 BUFFER
+# ============================================================
+
+def parse_embedding(raw: bytes) -> np.ndarray:
+    """
+    Decode a Titan embedding response body straight into a float32
+    array. The "embedding" JSON array is parsed by NumPy, so no list of
+    boxed Python floats is built. Falls back to json for anything
+    unexpected.
+    """
+
+    start = raw.find(b'"embedding"')
+
+    if start != -1:
+
+        lb = raw.find(b"[", start)
+        rb = raw.find(b"]", lb)
+
+        if lb != -1 and rb != -1:
+
+            body = raw[lb + 1:rb]
+
+            vector = np.fromstring(body.decode("ascii"), dtype=np.float32, sep=",")
+
+            if vector.size and vector.size == body.count(b",") + 1:
+                return vector
+
+    return np.asarray(json.loads(raw)["embedding"], dtype=np.float32)
+
+
+# ============================================================
+# FLOAT32 BUFFER ↔ REDIS BYTES
+# ============================================================
+
+def to_float32_bytes(vector) -> memoryview:
+    """
+    Byte view of a float32 vector for Redis. Arrays already in float32
+    are passed through without copying; lists are converted once.
+    """
+
+    array = np.ascontiguousarray(vector, dtype=np.float32)
+
+    return memoryview(array).cast("B")
+
+
+def from_float32_bytes(raw) -> np.ndarray:
+    """
+    Zero-copy float32 array over bytes read from Redis (read-only).
+    """
+
+    return np.frombuffer(raw, dtype=np.float32)